@@ -7,352 +7,179 @@
 import warnings
 warnings.filterwarnings("ignore")
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import colors
-import seaborn as sns
-import ternary
-from numba import njit
-from tqdm import tqdm
 import argparse
 import os
 
-parser = argparse.ArgumentParser("PDE solution")
-parser.add_argument("plot", help="If 'yes' snapshots of the simulation will be saved according to the number of snapshots (default=300). Otherwise no plot will be generated.", type=str)
-parser.add_argument("size", help="Size of the lattice.", type=int)
-parser.add_argument("total_steps", help="Number of simulation steps.", type=int)
-parser.add_argument("mu", help="Reproduction rate.", type=float)
-parser.add_argument("sigma", help="Dominance-removal rate.", type=float)
-parser.add_argument("D", help="Hopping rate. Hopping is the movement an individual has when it moves from it's local site to a neighboring empty one.", type=float)
-parser.add_argument("epsilon", help="Pair-exchange rate. Pair-exchange is the movement an in individual has when it switches it's local site with it's neighbor's. Compared to hopping, this is understood as movement through crowded areas where the movement of one must displace the other.", type=float)
-parser.add_argument("snapshots", help="(Optional argument) Number of snapshots to save during the simulation.", type=int,
-                    nargs='?', default=300)
-args = parser.parse_args()
-
-plot = args.plot
-
-# if plot == 'y' or plot == 'yes':
-#     try:
-#         plt.rc('text', usetex=True)
-#         plt.rc('font', family='serif')
-#     except Exception as e:
-#         print("LaTeX not found or not uploaded, using Matplotlib default font.")
-#         print(f"Error type: {type(e)}\nError message: {e}")
-
-@njit
-def numba_choice(n, p):
-    """
-    Numba-compatible version of np.random.choice
-    
-    Parameters:
-    - n: Number of possible choices
-    - p: Probability weights (will be normalized)
-    
-    Returns:
-    - Selected index
-    """
-    # Normalize probabilities
-    p_norm = p / np.sum(p)
-    
-    # Generate cumulative probabilities
-    cumulative_p = np.cumsum(p_norm)
-    
-    # Random uniform draw
-    r = np.random.random()
-    
-    # Find the first index where cumulative prob exceeds random draw
-    for i in range(n):
-        if r <= cumulative_p[i]:
-            return i
-    
-    # Fallback (should rarely happen due to normalization)
-    return n - 1
-
-@njit
-def compute_global_rates(space, sigma=1.0, epsilon=5.0, mu=1.0, D=5.0):
-    """
-    Compute global reaction rates based on pair types and empty spaces
-    
-    Parameters:
-    - space: Lattice grid
-    - sigma: Competition rate
-    - epsilon: Pair-exchange rate
-    - mu: Reproduction rate
-    - D: Hopping rate
-    
-    Returns:
-    - Global reaction rates and corresponding reactions
-    """
-    size = space.shape[0]
-    rates = np.zeros(4) # Reaction orders: competition, pair-exchange, reproduction, hopping
-    reactions = []
-    
-    # Precompute pair counting
-    pair_counts = {
-        (1, 2): 0, (1, 3): 0,  # A-B, A-C interactions
-        (2, 3): 0, (2, 1): 0,  # B-C, B-A interactions
-        (3, 1): 0, (3, 2): 0   # C-A, C-B interactions
-    }
-    empty_count = 0
-    
-    # Count pair interactions and empty spaces
-    for x in range(size):
-        for y in range(size):
-            if space[x, y] == 0:
-                empty_count += 1
-                continue
-            
-            # Check neighbors
-            for dx, dy in [(0,1), (1,0), (0,-1), (-1,0), 
-                           (1,1), (1,-1), (-1,1), (-1,-1)]:
-                nx, ny = (x + dx) % size, (y + dy) % size
-                
-                if space[nx, ny] == 0:
-                    # Reproduction/Hopping to empty site
-                    rates[2] += mu
-                    reactions.append(('reproduction', (x, y), (nx, ny)))
-                    
-                    rates[3] += D
-                    reactions.append(('hopping', (x, y), (nx, ny)))
-                
-                elif space[nx, ny] != space[x, y]:
-                    # Pair interaction
-                    pair_type = (space[x, y], space[nx, ny])
-                    rates[0] += sigma
-                    reactions.append(('competition', (x, y), (nx, ny)))
-                    
-                    rates[1] += epsilon
-                    reactions.append(('pair-exchange', (x, y), (nx, ny)))
-    
-    return rates, reactions
-
-@njit
-def gillespie_lattice_step(space, t, mcs, sigma=1.0, mu=1.0, epsilon=5.0, D=5.0):
-    """
-    Perform a single Gillespie algorithm step on the lattice
-    
-    Parameters:
-    - space: Lattice grid
-    - t: Time array
-    - sigma: Competition rate
-    - mu: Reproduction rate
-    - epsilon: Pair-exchange rate
-    - D: Hopping rate
-    
-    Returns:
-    - Updated space grid
-    - Updated time array
-    """
-    # Compute global reaction rates
-    rates, reactions = compute_global_rates(space, sigma, epsilon, mu, D)
-    
-    population = float(len(np.where(space != 0)[0]))
-    
-    if len(rates) == 0:
-        return space, t, mcs
-    
-    # Total rate
-    total_rate = np.sum(rates)
-    
-    # Generate time step
-    tau = np.random.exponential(1/total_rate)
-    
-    # Select reaction
-    reaction_index = numba_choice(len(rates), p=rates/total_rate)
-    
-    if reaction_index == 0:
-        selected_reaction = 'competition'
-    elif reaction_index == 1:
-        selected_reaction = 'pair-exchange'
-    elif reaction_index == 2:
-        selected_reaction = 'reproduction'
-    elif reaction_index == 3:
-        selected_reaction = 'hopping'
+from gillespie_utils import run_simulation, run_parameters, STOP_ABSORBING, STOP_EXTINCTION, STOP_CONVERGED
+from montecarlo_utils import check_tiling
+from lattice_utils import LATTICE_DTYPE
+from storage import ResultsWriter
+
+def main():
+    parser = argparse.ArgumentParser("PDE solution")
+    parser.add_argument("plot", help="If 'yes' snapshots of the simulation will be saved according to the number of snapshots (default=300). If 'raw' the lattice snapshots are streamed to Snapshots_Gillespe.npz, to be rendered later with render_snapshots.py. Otherwise no plot will be generated.", type=str)
+    parser.add_argument("size", help="Size of the lattice.", type=int)
+    parser.add_argument("total_steps", help="Number of simulation steps.", type=int)
+    parser.add_argument("mu", help="Reproduction rate.", type=float)
+    parser.add_argument("sigma", help="Dominance-removal rate.", type=float)
+    parser.add_argument("D", help="Hopping rate. Hopping is the movement an individual has when it moves from it's local site to a neighboring empty one.", type=float)
+    parser.add_argument("epsilon", help="Pair-exchange rate. Pair-exchange is the movement an in individual has when it switches it's local site with it's neighbor's. Compared to hopping, this is understood as movement through crowded areas where the movement of one must displace the other.", type=float)
+    parser.add_argument("snapshots", help="(Optional argument) Number of snapshots to save during the simulation.", type=int,
+                        nargs='?', default=300)
+    parser.add_argument("--record_every", help="Record the densities every k events (default=1).", type=int, default=1)
+    parser.add_argument("--record_mcs", help="Record the densities every given interval of Monte Carlo time (the sum of the time steps divided by the number of individuals, in both modes) instead of counting events (default=0, disabled).", type=float, default=0.0)
+    parser.add_argument("--max_mcs", help="Stop the simulation once the Monte Carlo time (as for --record_mcs) reaches this value, even if total_steps events were not performed (default=no limit).", type=float, default=np.inf)
+    parser.add_argument("--mode", help="'gillespie' (default) for the exact sequential Gillespie algorithm or 'sublattice' for parallel random-sequential Monte Carlo sweeps, in which case total_steps, --record_every, --checkpoint_every and snapshots count sweeps. Times and Monte Carlo times have the same units in both modes.", type=str, default='gillespie', choices=['gillespie', 'sublattice'])
+    parser.add_argument("--tile", help="(Sublattice mode) Side of the tiles updated in parallel, the lattice size must be an even multiple of it (default=8).", type=int, default=8)
+    parser.add_argument("--exact_occupancy", help="Occupy exactly half of the sites initially, instead of each site with probability 1/2.", action='store_true')
+    parser.add_argument("--spectra", help="At every snapshot, store the radially averaged structure factor and two-point correlation of the species, with the correlation length and spiral wavelength, in the results file.", action='store_true')
+    parser.add_argument("--stop_extinction", help="Stop as soon as a species goes extinct.", action='store_true')
+    parser.add_argument("--converge_window", help="Stop once the fractions of all species stayed within --converge_tol over this number of records, checked every converge_window records (default=0, disabled).", type=int, default=0)
+    parser.add_argument("--converge_tol", help="Tolerance (max - min of each fraction) of the convergence criterion (default=1e-3).", type=float, default=1e-3)
+    parser.add_argument("--checkpoint", help="File where the state of the run (lattice, clocks, random state and records) is saved periodically and at the end (default=no checkpoints).", type=str, default=None)
+    parser.add_argument("--checkpoint_every", help="Events (sweeps in sublattice mode) between checkpoints (default=only at the end).", type=int, default=None)
+    parser.add_argument("--restart", help="Resume the run saved in this checkpoint file, with the same parameters. The densities in the results file again cover the whole run, snapshots and spectra only the resumed part.", type=str, default=None)
+    parser.add_argument("--seed", help="Seed of the random number generators, for reproducible runs (default=random, stored in the results file).", type=int, default=None)
+    args = parser.parse_args()
+    
+    plot = args.plot
+    
+    # if plot == 'y' or plot == 'yes':
+    #     try:
+    #         plt.rc('text', usetex=True)
+    #         plt.rc('font', family='serif')
+    #     except Exception as e:
+    #         print("LaTeX not found or not uploaded, using Matplotlib default font.")
+    #         print(f"Error type: {type(e)}\nError message: {e}")
+    
+    # Seed actually used, stored with the results so that the run can be reproduced
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2**31)
+    
+    # Invalid arguments and checkpoints are reported before any file is written
+    if args.mode == 'sublattice':
+        try:
+            check_tiling(args.size, args.tile)
+        except ValueError as e:
+            parser.error(str(e))
+    start = 0
+    if args.restart is not None:
+        from storage import load_checkpoint
+        _, checkpoint = load_checkpoint(args.restart, run_parameters(
+            args.size, 0.5, args.sigma, args.mu, args.epsilon, args.D, args.record_every, args.record_mcs,
+            args.mode, args.tile))
+        seed, start = checkpoint['seed'], checkpoint['events']
+    
+    # The records are written to the results file at every snapshot, which leaves it readable with
+    # the records so far if the job is killed, and completed with them if the run fails or is
+    # interrupted. The final lattice is added at the end.
+    with ResultsWriter('Result_Gillespe.npz', dict(vars(args), seed=seed, model='Gillespie lattice', initial_density=0.5)) as results:
+        densities = results.series('densities', (3,))
+        mcs = results.series('mcs')
+        written = 0
         
-    pair_options = [item for item in reactions
-                          if item[0] == selected_reaction]
-    selected_pair = np.random.randint(len(pair_options))
-    
-    # Perform reaction
-    reaction_type, (x1, y1), (x2, y2) = pair_options[selected_pair]
-    
-    if reaction_type == 'competition':
-        # Competitive interaction
-        winner_matrix = np.array([
-            [1, 2, 0],  # A's outcomes against B, C
-            [0, 1, 2],  # B's outcomes against C, A
-            [2, 0, 1]   # C's outcomes against A, B
-        ])
+        spectra = None
+        if args.spectra:
+            from analysis import SpectrumSeries, indicators
+            spectra = SpectrumSeries(results, args.size)
         
-        type1, type2 = space[x1, y1], space[x2, y2]
-        outcome = winner_matrix[type1-1, type2-1]
-        
-        if outcome == 2:
-            space[x2, y2] = 0  # Loser is removed
-        elif outcome == 0:
-            space[x1, y1] = 0  # Focal species is removed
-    
-    elif reaction_type == 'reproduction':
-        # Reproduce to empty site
-        space[x2, y2] = space[x1, y1]
-    
-    elif reaction_type == 'hopping' or reaction_type == 'pair-exchange':
-        # Exchange species
-        space[x2, y2], space[x1, y1] = space[x1, y1], space[x2, y2]
-    
-    # Update time
-    t = np.append(t, t[-1] + tau)
-    mcs = np.append(mcs, mcs[-1] + tau/population)
-    
-    return space, t, mcs
-
-if plot == 'y' or plot == 'yes':
-    isExist = os.path.exists('./Frames_Gillespe')
-    if isExist == False:
-        os.mkdir('./Frames_Gillespe')
-
-# @njit
-def run_simulation(size=100, initial_density=0.5, total_steps=1000, sigma=1.0, mu=1.0, epsilon=5.0, D=5.0, palette = 'inferno'):
-    """
-    Run full lattice Gillespie simulation
-    """
-    # Initialize space
-    space = np.zeros((size, size), dtype=np.int32)
-    species = [1, 2, 3]  # A, B, C
-    for x in range(size):
-        for y in range(size):
-            if np.random.uniform(0, 1) < initial_density:
-                space[x, y] = np.random.choice(species)
-    
-    # Initialize time array
-    t = np.array([0.0])
-    mcs = np.array([0.0])
-    populations = np.zeros((3,total_steps+1))
-    
-    # Run simulation
-    frame = 0
-    if plot == 'y' or plot == 'yes':
-        fig, axs = plt.subplots(2, 2, figsize=(10, 10))
-        ax = axs.flatten()
-    
-    for s in tqdm(range(total_steps+1)):
-        space, t, mcs = gillespie_lattice_step(space, t, mcs, sigma, mu, epsilon, D)
-        
-        populations[0,s] = len(np.where(space == 1)[0])
-        populations[1,s] = len(np.where(space == 2)[0])
-        populations[2,s] = len(np.where(space == 3)[0])
-        
-        final_fracN1 = populations[0,:s+1]
-        final_fracN2 = populations[1,:s+1]
-        final_fracN3 = populations[2,:s+1]
-
-        total = final_fracN1+final_fracN2+final_fracN3
-
-        y = np.array([final_fracN1/total, final_fracN2/total, final_fracN3/total]).T
+        def save_records(recorder):
+            nonlocal written
+            populations = recorder.populations[:, written:]
+            densities.extend((populations / np.sum(populations, axis=0)).T, recorder.t[written:])
+            mcs.extend(recorder.mcs[written:], recorder.t[written:])
+            written = recorder.size
         
+        draw = None
+        writer = None
+        snapshot_every = max(args.total_steps//args.snapshots, 1)
         if plot == 'y' or plot == 'yes':
-            if s % (total_steps//args.snapshots) == 0:
-                
-                cmap = colors.ListedColormap([sns.color_palette(palette, 12)[0],
-                                            sns.color_palette(palette, 12)[3],
-                                            sns.color_palette(palette, 12)[7],
-                                            sns.color_palette(palette, 12)[11]])
-                bounds=[-0.5,0.5,1.5,2.5,3.5]
-                norm = colors.BoundaryNorm(bounds, cmap.N)
-                
-                ax[1].clear()
-                ax[0].clear()
-                ax[2].clear()
-                ax[3].clear()
-                
-                img = ax[0].imshow(space, cmap=cmap, norm=norm, vmin = 0, vmax = 3)
-                ax[0].set_title(f'Lattice State at t = {t[-1]:.2f}')
-                ax[0].axis('off')
-                if frame == 0:
-                    cbar = plt.colorbar(img, cmap=cmap, norm=norm, boundaries=bounds, ticks=[0, 1, 2, 3], shrink = 0.85, ax = ax[0])
-                    cbar.set_ticklabels([r'$\varnothing$', 'A', 'B', 'C'])
-                
-                ax[1].plot(t[1:], populations[0,:s+1]/np.sum(populations[:,:s+1], axis = 0), label = 'Type A', color = sns.color_palette(palette, 12)[3], lw = 2)
-                ax[1].plot(t[1:], populations[1,:s+1]/np.sum(populations[:,:s+1], axis = 0), label = 'Type B', color = sns.color_palette(palette, 12)[7], lw = 2)
-                ax[1].plot(t[1:], populations[2,:s+1]/np.sum(populations[:,:s+1], axis = 0), label = 'Type C', color = sns.color_palette(palette, 12)[11], lw = 2)
-                ax[1].set_ylim(0, 1)
-                ax[1].legend(loc = 'upper center', ncol = 3)
-                ax[1].set_title('Populations Evolution')
-                ax[1].set_xlabel('Time')
-                ax[1].set_ylabel('Fraction of total')
-                ax[1].set_xlim(0, 30)
-                ax[1].patch.set_facecolor("gray")
-                
-                _, tax = ternary.figure(ax = ax[3])
-
-                tax.plot(y, color='black', lw = 1)
-                tax.boundary(linewidth=1.0)
-                tax.gridlines(color="grey", multiple=0.1, alpha = 0.3)
-
-                tax.left_axis_label("C", fontsize=12, offset = 0.12)
-                tax.right_axis_label("B", fontsize=12, offset = 0.12)
-                tax.bottom_axis_label("A", fontsize=12, offset = 0.12)
-
-                tax.ticks(axis='lbr', multiple=0.2, linewidth=1, tick_formats="%.1f", offset=0.02,
-                        fontsize = 9)
-                # tax.lim(0, 1)
-                tax.get_axes().axis('off')
-                
-                
-                ax[2].set_ylim(0, 1)
-                ax[2].set_xlim(0, 1)
-                ax[2].text(0.5, 0.9, r'Lattice size $L$ = ' + f'{size}',
-                        ha = 'center', fontsize = 12)
-                ax[2].text(0.5, 0.8, 'Reactions',
-                        ha = 'center', fontsize = 12, weight = 'bold')
-                ax[2].text(0.5, 0.7, r'$A + B \underset{\sigma}{\rightarrow} \varnothing + A$',
-                        ha = 'center', fontsize = 11)
-                ax[2].text(0.5, 0.6, r'$B + C \underset{\sigma}{\rightarrow} \varnothing + B$',
-                        ha = 'center', fontsize = 11)
-                ax[2].text(0.5, 0.5, r'$C + A \underset{\sigma}{\rightarrow} \varnothing + C$',
-                        ha = 'center', fontsize = 11)
-                ax[2].text(0.5, 0.4, r'$X + Y \underset{\epsilon}{\rightarrow} Y + X$',
-                        ha = 'center', fontsize = 11)
-                ax[2].text(0.5, 0.3, r'$X + \varnothing \underset{D}{\rightarrow} \varnothing + X$',
-                        ha = 'center', fontsize = 11)
-                ax[2].text(0.5, 0.2, r'$X + \varnothing \underset{\mu}{\rightarrow} X + X$',
-                        ha = 'center', fontsize = 11)
-                ax[2].text(0.5, 0.01, r'$\sigma = $' + f'{sigma:.1f}, ' + r'$\epsilon = $' + f'{epsilon:.1f}, ' + r'$D = $' + f'{D}, ' + f'$\mu = $' + f'{mu:.1f}',
-                        ha = 'center', fontsize = 11)
-                ax[2].axis('off')
-                ax[2].patch.set_facecolor('#cfcfcf')
-                
-                fig.patch.set_facecolor('#cfcfcf')
-                
+            import matplotlib.pyplot as plt
+            from plots import draw_lattice_frame
+            
+            isExist = os.path.exists('./Frames_Gillespe')
+            if isExist == False:
+                os.mkdir('./Frames_Gillespe')
+            
+            fig, axs = plt.subplots(2, 2, figsize=(10, 10))
+            ax = axs.flatten()
+            frame = start // snapshot_every
+            
+            def draw(lattice, recorder):
+                nonlocal frame
+                if lattice.events == 0:
+                    return
+                draw_lattice_frame(fig, ax, lattice.space, lattice.t, recorder, frame,
+                                   args.sigma, args.epsilon, args.D, args.mu, palette='inferno')
                 plt.savefig(f'./Frames_Gillespe/frame_{frame}.png', dpi = 100, bbox_inches = 'tight')
-                
                 frame += 1
-    
-    return space, t, mcs, populations
-
-# Run the simulation
-final_space, times, mcs, populations = run_simulation(
-    size=args.size,
-    initial_density=0.5,
-    total_steps=args.total_steps,
-    sigma=args.sigma,
-    mu=args.mu,
-    epsilon=args.epsilon,
-    D=args.D,
-    palette='inferno'
-)
-
-final_fracN1 = populations[0]
-final_fracN2 = populations[1]
-final_fracN3 = populations[2]
-
-total = final_fracN1+final_fracN2+final_fracN3
-
-y = np.array([final_fracN1/total, final_fracN2/total, final_fracN3/total]).T
-
-print("\nSimulation finished!")
-print("\n")
-print(f"Lattice file shape: {final_space.shape}")
-print(f"Densities file shape: {y.shape}")
-
-np.savetxt('Result_densities_Gillespe.txt', y)
-np.savetxt('Result_lattice_Gillespe.txt', final_space)
\ No newline at end of file
+        elif plot == 'raw':
+            from storage import ChunkedArrayWriter
+            
+            # Raw lattices are compressed and written by a background thread, rendering is done offline
+            # A restarted run does not overwrite the snapshots taken before the checkpoint
+            path = 'Snapshots_Gillespe.npz' if start == 0 else f'Snapshots_Gillespe_from_{start}.npz'
+            writer = ChunkedArrayWriter(path, (args.size, args.size), LATTICE_DTYPE)
+            
+            def draw(lattice, recorder):
+                writer.append(lattice.space, lattice.t)
+        
+        def callback(lattice, recorder):
+            save_records(recorder)
+            if spectra is not None:
+                spectra.append(indicators(lattice.space), lattice.t)
+            results.sync()
+            if draw is not None:
+                draw(lattice, recorder)
+        
+        # Run the simulation
+        try:
+            final_space, recorder, status = run_simulation(
+                size=args.size,
+                initial_density=0.5,
+                total_steps=args.total_steps,
+                sigma=args.sigma,
+                mu=args.mu,
+                epsilon=args.epsilon,
+                D=args.D,
+                record_every=args.record_every,
+                record_mcs=args.record_mcs,
+                max_mcs=args.max_mcs,
+                mode=args.mode,
+                tile=args.tile,
+                seed=seed,
+                snapshot_every=snapshot_every,
+                callback=callback,
+                progress=True,
+                checkpoint=args.checkpoint,
+                checkpoint_every=args.checkpoint_every,
+                restart=args.restart,
+                stop_extinction=args.stop_extinction,
+                exact_occupancy=args.exact_occupancy,
+                converge_window=args.converge_window,
+                converge_tol=args.converge_tol
+            )
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        save_records(recorder)
+        results.write('lattice', final_space)
+        results.write('status', status)
+    
+    if status == STOP_ABSORBING:
+        print(f"\nAbsorbing state reached at t = {recorder.t[-1]:.3f}.")
+    elif status == STOP_EXTINCTION:
+        print(f"\nA species went extinct at t = {recorder.t[-1]:.3f}.")
+    elif status == STOP_CONVERGED:
+        print(f"\nThe densities converged at t = {recorder.t[-1]:.3f}.")
+    print("\nSimulation finished!")
+    print("\n")
+    print(f"Lattice shape: {final_space.shape}")
+    print(f"Densities shape: {(recorder.size, 3)}")
+    if spectra is not None:
+        _, _, length, wavelength = spectra.last
+        print(f"Last snapshot: correlation length {length:.3f}, wavelength {wavelength:.3f}")
+    print(f"Results saved to {results.path}")
+
+if __name__ == '__main__':
+    main()
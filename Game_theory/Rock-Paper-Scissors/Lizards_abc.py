@@ -0,0 +1,284 @@
+"""
+    Approximate Bayesian computation of the parameters of the lizard model
+    (Lizards_model) from observed yearly fractions of the morphs.
+
+    ABC-SMC: a population of particles (parameter points) is moved through
+    a decreasing sequence of tolerances. The first population is drawn from
+    a uniform prior. At each following generation the tolerance is a
+    quantile of the distances of the previous population, particles are
+    proposed by perturbing previous ones (drawn by weight) with a Gaussian
+    kernel of twice their weighted covariance, and a proposal is accepted
+    if its simulation ends within the tolerance. Importance weights
+    correct for the proposal distribution.
+
+    The distance is the one of Lizards_fit.ipynb: mean over the years of
+    the squared error of the fractions, summed over the morphs. Its terms
+    are positive, so a simulation is stopped as soon as its partial
+    distance exceeds the tolerance (see Lizards_model.run_years): most
+    rejected proposals diverge within a few years.
+
+    The simulations of a round of proposals run in parallel (run_batch),
+    each with its own seed. Their summaries are kept in a SimulationCache
+    keyed by parameters and seed, so repeating an inference with the same
+    seed, or continuing it, does not simulate again.
+
+    Example:
+        abc = ABCSMC(lizard_data[1:], bounds=dict(p1=(0, 1), p2=(0, 1), p3=(0, 1)),
+                     fixed=dict(r=0.6, mu=0.01), x0=50, proportion=(0.113, 0.327, 0.561), seed=1)
+        populations = abc.run(generations=8, progress=True)
+        print(abc.estimate())
+
+    References:
+    - Toni, T., Welch, D., Strelkowa, N., Ipsen, A., & Stumpf, M. P. (2009). Approximate Bayesian computation scheme for parameter inference and model selection in dynamical systems. Journal of the Royal Society Interface, 6(31), 187-202.
+    - Beaumont, M. A., Cornuet, J. M., Marin, J. M., & Robert, C. P. (2009). Adaptive approximate Bayesian computation. Biometrika, 96(4), 983-990.
+"""
+
+import numpy as np
+
+from Lizards_model import run_batch, probability_matrix, initial_cohort, check_size
+from rng_utils import seed_streams
+
+# Parameters of exec_sim that can be fitted, and their default values
+PARAMETERS = ('r', 'p1', 'p2', 'p3', 'mu')
+DEFAULTS = dict(r=0.6, p1=0.6, p2=0.8, p3=0.5, mu=0.01)
+
+class SimulationCache:
+    """
+    Yearly fractions and distance of simulations, keyed by parameters and seed
+
+    A simulation stopped early (NaN for the years not simulated) only tells
+    that its distance exceeds its partial distance: it is reused for a
+    tolerance below that value and simulated again otherwise. The
+    distances are those to one set of observed data, a cache must not be
+    shared by inferences on different data or simulation settings.
+    """
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(params, seed):
+        return tuple(float(p) for p in params), int(seed)
+
+    def get(self, params, seed, threshold):
+        """
+        Fractions and distance of a simulation, or None if it must be simulated
+        """
+        entry = self._entries.get(self._key(params, seed))
+        if entry is not None:
+            y, d = entry
+            if not np.isnan(y[-1, 0]) or d > threshold:
+                self.hits += 1
+                return y, d
+        self.misses += 1
+        return None
+
+    def put(self, params, seed, y, d):
+        self._entries[self._key(params, seed)] = (y, d)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self, path):
+        keys = list(self._entries)
+        np.savez(path, params=np.array([k[0] for k in keys]).reshape(len(keys), -1),
+                 seeds=np.array([k[1] for k in keys], dtype=np.int64),
+                 y=np.array([self._entries[k][0] for k in keys]),
+                 distances=np.array([self._entries[k][1] for k in keys]))
+
+    @classmethod
+    def load(cls, path):
+        cache = cls()
+        with np.load(path) as data:
+            for params, seed, y, d in zip(data['params'], data['seeds'], data['y'], data['distances']):
+                cache.put(params, seed, y, d)
+        return cache
+
+class ABCSMC:
+    """
+    ABC-SMC inference of the parameters of exec_sim
+
+    Parameters:
+    - observed: Observed fractions of the morphs at the end of every year, shape (years, 3)
+    - bounds: Dictionary with the (low, high) bounds of the uniform prior of each fitted parameter
+    - fixed: Values of the parameters that are not fitted (default: those of exec_sim)
+    - n_particles: Number of particles of each population
+    - quantile: Quantile of the distances of a population giving the next tolerance
+    - max_simulations: Number of simulations after which a generation that did not
+      fill its population is abandoned, ending the inference (default: 100*n_particles)
+    - S, x0, proportion: As in exec_sim
+    - seed: Seed of the proposals and of the simulations
+    - cache: SimulationCache to reuse (default: a new one, available as self.cache)
+
+    Attributes:
+    - populations: List of populations, dictionaries with the particles (values of the
+      fitted parameters, shape (n_particles, fitted)), weights, distances, tolerance,
+      number of simulations and acceptance rate of each generation
+    - simulated_years, requested_years: Years simulated and years the simulations would
+      have taken without early rejection
+    """
+    def __init__(self, observed, bounds, fixed=None, n_particles=200, quantile=0.5, max_simulations=None, S=30, x0=10,
+                 proportion=(1/3,1/3,1/3), seed=None, cache=None):
+        fixed = fixed or {}
+        unknown = (set(bounds) | set(fixed)) - set(PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)}, expected some of {PARAMETERS}")
+        if len(bounds) == 0:
+            raise ValueError("No parameter to fit")
+        self.observed = np.ascontiguousarray(observed, dtype=np.float64)
+        self.names = [name for name in PARAMETERS if name in bounds]
+        self.free = np.array([PARAMETERS.index(name) for name in self.names])
+        self.low = np.array([bounds[name][0] for name in self.names], dtype=np.float64)
+        self.high = np.array([bounds[name][1] for name in self.names], dtype=np.float64)
+        self.base = np.array([dict(DEFAULTS, **fixed)[name] for name in PARAMETERS], dtype=np.float64)
+        self.n_particles = n_particles
+        self.quantile = quantile
+        self.max_simulations = 100 * n_particles if max_simulations is None else max_simulations
+        self.cohort = initial_cohort(x0, proportion)
+        self.S = check_size(S, self.cohort)
+        self.rng = np.random.default_rng(seed)
+        self.cache = SimulationCache() if cache is None else cache
+        self.populations = []
+        self.simulated_years = 0
+        self.requested_years = 0
+
+    def points(self, particles):
+        """
+        Full parameter points (r, p1, p2, p3, mu) of particles
+        """
+        points = np.tile(self.base, (len(particles), 1))
+        points[:, self.free] = particles
+        return points
+
+    def simulate(self, particles, threshold=np.inf):
+        """
+        Distances of particles to the observed data, one simulation each with a fresh
+        seed, stopped once its distance exceeds threshold
+
+        Returns:
+        - distances: Distance of each simulation (partial for the ones stopped early)
+        - y: Yearly fractions, shape (particles, years, 3), NaN for the years not simulated
+        """
+        points = self.points(particles)
+        seeds = self.rng.integers(2**31, size=len(points))
+        years = len(self.observed)
+        distances = np.empty(len(points))
+        y = np.empty((len(points), years, 3))
+
+        missing = []
+        for i in range(len(points)):
+            cached = self.cache.get(points[i], seeds[i], threshold)
+            if cached is None:
+                missing.append(i)
+            else:
+                y[i], distances[i] = cached
+
+        if missing:
+            missing = np.array(missing)
+            # The stream of seed s is the one exec_sim(..., seed=s) draws from
+            states = np.array([seed_streams(s, 1)[0] for s in seeds[missing]])
+            probabilities = np.array([probability_matrix(*point[:4]) for point in points[missing]])
+            y_new, d_new = run_batch(probabilities, points[missing, 4].copy(), self.S, years, self.cohort, 1,
+                                     states, self.observed, threshold)
+            y[missing], distances[missing] = y_new[:, 0], d_new[:, 0]
+            self.simulated_years += np.count_nonzero(~np.isnan(y_new[:, 0, :, 0]))
+            self.requested_years += len(missing) * years
+            for i in missing:
+                self.cache.put(points[i], seeds[i], y[i], distances[i])
+        return distances, y
+
+    def sample_prior(self, n):
+        return self.rng.uniform(self.low, self.high, size=(n, len(self.names)))
+
+    def _generation(self, previous, threshold):
+        particles, weights = previous['particles'], previous['weights']
+        n, dim = particles.shape
+        covariance = 2 * np.atleast_2d(np.cov(particles, rowvar=False, aweights=weights))
+        # A collapsed parameter would make the covariance singular
+        covariance += 1e-12 * np.eye(dim)
+        cholesky = np.linalg.cholesky(covariance)
+
+        accepted, accepted_distances = [], []
+        n_accepted, simulations, proposed = 0, 0, 0
+        acceptance = previous['acceptance']
+        while n_accepted < n:
+            # Proposals outside the prior are not simulated but must not loop forever either
+            if simulations >= self.max_simulations or proposed >= 10 * self.max_simulations:
+                return None
+            # Enough proposals to fill the population at the last acceptance rate
+            n_proposals = min(int(1.2 * (n - n_accepted) / max(acceptance, 1e-3)) + 1, 20 * n,
+                              self.max_simulations - simulations)
+            proposed += n_proposals
+            parents = self.rng.choice(n, size=n_proposals, p=weights)
+            proposals = particles[parents] + self.rng.standard_normal((n_proposals, dim)) @ cholesky.T
+            proposals = proposals[np.all((proposals >= self.low) & (proposals <= self.high), axis=1)]
+            if len(proposals) == 0:
+                continue
+            distances, _ = self.simulate(proposals, threshold)
+            simulations += len(proposals)
+            keep = distances <= threshold
+            accepted.append(proposals[keep])
+            accepted_distances.append(distances[keep])
+            n_accepted += np.count_nonzero(keep)
+            acceptance = n_accepted / simulations
+
+        new = np.concatenate(accepted)[:n]
+        new_distances = np.concatenate(accepted_distances)[:n]
+
+        # Uniform prior: weight inversely proportional to the density of the proposal
+        z = np.linalg.solve(cholesky, (new[:, None, :] - particles[None, :, :]).reshape(-1, dim).T)
+        kernel = np.exp(-0.5 * np.sum(z**2, axis=0)).reshape(n, n)
+        new_weights = 1 / (kernel @ weights)
+        new_weights /= new_weights.sum()
+        return dict(particles=new, weights=new_weights, distances=new_distances, threshold=threshold,
+                    simulations=simulations, acceptance=n / simulations)
+
+    def run(self, generations=10, min_threshold=0.0, min_acceptance=0.01, progress=False):
+        """
+        Run ABC-SMC generations, continuing from the last population if any
+
+        Parameters:
+        - generations: Maximum number of generations after the prior population
+        - min_threshold: Stop once the tolerance reaches this value
+        - min_acceptance: Stop once the acceptance rate falls below this value
+        The inference also stops when a generation needs more than max_simulations
+        simulations, that generation being discarded.
+        - progress: Whether to print the tolerance and acceptance rate of every generation
+
+        Returns:
+        - List of populations (see the class attributes)
+        """
+        n = self.n_particles
+        if not self.populations:
+            particles = self.sample_prior(n)
+            distances, _ = self.simulate(particles)
+            self.populations.append(dict(particles=particles, weights=np.full(n, 1 / n), distances=distances,
+                                         threshold=np.inf, simulations=n, acceptance=1.0))
+
+        for _ in range(generations):
+            previous = self.populations[-1]
+            if previous['threshold'] <= min_threshold or previous['acceptance'] < min_acceptance:
+                break
+            threshold = max(np.quantile(previous['distances'], self.quantile), min_threshold)
+            population = self._generation(previous, threshold)
+            if population is None:
+                if progress:
+                    print(f"Tolerance {threshold:.4g} not reached within {self.max_simulations} simulations, stopping")
+                break
+            self.populations.append(population)
+            if progress:
+                population = self.populations[-1]
+                print(f"Generation {len(self.populations) - 1}: tolerance {threshold:.4g}, "
+                      f"acceptance {population['acceptance']:.3f}, {population['simulations']} simulations, "
+                      f"{self.simulated_years / self.requested_years:.1%} of the years simulated")
+        return self.populations
+
+    def estimate(self):
+        """
+        Weighted mean and standard deviation of each fitted parameter in the last population
+        """
+        population = self.populations[-1]
+        mean = np.average(population['particles'], axis=0, weights=population['weights'])
+        std = np.sqrt(np.average((population['particles'] - mean)**2, axis=0, weights=population['weights']))
+        return {name: (m, s) for name, m, s in zip(self.names, mean, std)}
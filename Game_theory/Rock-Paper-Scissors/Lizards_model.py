@@ -1,174 +1,274 @@
+"""
+    Side-blotched lizard model: three morphs competing on a lattice in a
+    rock-paper-scissors cycle, with yearly generations.
+
+    Every year a cohort of eggs, split between the morphs according to the
+    fractions of the previous year (the initial population x0, proportion
+    in the first year), is placed on an empty lattice (each egg mutating to
+    one of the other morphs with probability mu). The lattice then evolves
+    for 12 monthly rounds of stochastic_run.
+
+    The whole season loop runs in compiled code, with the number of sites
+    of each type kept up to date by every change of the lattice, so a
+    call of exec_sim does not return to Python before the end of the run.
+    Each run draws from its own random stream (see rng_utils), so exec_batch
+    runs replicates of many parameter sets in parallel with numba.prange,
+    reproducibly whatever the number of threads.
+
+    The lattice is a periodic S x S array of LATTICE_DTYPE, handled through
+    its flat view and the neighbour table of lattice_utils (built once per
+    call and shared by all runs), so large lattices (S = 512 and above)
+    cost no more per site than small ones.
+"""
+
 import numpy as np
-from numba import njit
+from numba import njit, prange
+
+from rng_utils import seed_streams, next_double, next_int
+from lattice_utils import LATTICE_DTYPE, neighbour_table, neighbour, place_individuals
+
+# Largest yearly cohort: 6 eggs for each of 110 females, plus 1 from rounding the morphs
+MAX_COHORT = 6*110 + 1
+
+@njit
+def set_site(sites, counts, i, value):
+    counts[sites[i]] -= 1
+    counts[value] += 1
+    sites[i] = value
 
 @njit
-def stochastic_run(space, probabilities, size):
-    positions = np.where(space != 0)
-    # print('positions: ', len(positions[0]))
-    for p in range(len(positions[0])):
-        # print(p)
-        focal = p
-        type_focal = int(space[positions[0][focal],positions[1][focal]])
-        # print('focal position: ', positions[0][focal], positions[1][focal])
-        # print('focal type: ', type_focal)
-        
-        location = np.random.randint(-1, 2, 2)
-        while location[0] == 0 and location[1] == 0:
-            location = np.random.randint(-1, 2, 2)
-            
-        neighbor_position = np.array([(positions[0][focal] + location[0])%size, (positions[1][focal] + location[1])%size])
-        type_competitor = int(space[neighbor_position[0],neighbor_position[1]])
-        # print('competitor position: ', neighbor_position)
-        # print('competitor type: ', type_competitor)
+def stochastic_run(sites, probabilities, neighbours, counts, occupied, states, stream):
+    """
+    One monthly round: every site occupied at the start of the round, in
+    row-major order, interacts with a random one of its 8 neighbours
+
+    Parameters:
+    - sites: Flat lattice, 0 for empty sites and 1, 2, 3 for the morphs, updated in place
+    - probabilities: probabilities[a, b] is the probability that a keeps its
+      site against b (column 0: probability of not reproducing into an empty site)
+    - neighbours: Neighbour table of the lattice (see lattice_utils.neighbour_table)
+    - counts: Number of sites of each type (empty, 1, 2, 3), updated in place
+    - occupied: Work buffer of at least len(sites) integers
+    - states, stream: Random streams and index of the one to draw from
+    """
+    n_occupied = 0
+    for i in range(len(sites)):
+        if sites[i] != 0:
+            occupied[n_occupied] = i
+            n_occupied += 1
+
+    for p in range(n_occupied):
+        focal = occupied[p]
+        type_focal = sites[focal]
+        competitor = neighbour(neighbours, focal, next_int(states, stream, 8))
+        type_competitor = sites[competitor]
 
         if type_competitor != 0:
-            result_focal = probabilities[type_focal, type_competitor]
-            result_competitor = probabilities[type_competitor, type_focal]
-            # print('focal payoff: ', result_focal)
-            # print('competitor payoff: ', result_competitor)
-            rand = np.random.uniform(0, 1)
+            rand = next_double(states, stream)
             if probabilities[type_focal, type_competitor] > 0:
                 if rand > probabilities[type_focal, type_competitor]:
-                    # print('filling space with: ', type_focal)
-                    space[neighbor_position[0],neighbor_position[1]] = type_focal
-                
+                    set_site(sites, counts, competitor, type_focal)
+
             if probabilities[type_competitor, type_focal] > 0:
-                rand = np.random.uniform(0, 1)
+                rand = next_double(states, stream)
                 if rand > probabilities[type_competitor, type_focal]:
-                    # print('filling space with: ', type_competitor)
-                    space[positions[0][focal],positions[1][focal]] = type_competitor
+                    set_site(sites, counts, focal, type_competitor)
         else:
-            # print('empty site!')
-            rand = np.random.uniform(0, 1)
+            rand = next_double(states, stream)
             if rand > probabilities[type_focal, type_competitor]:
-                # print('filling space with: ', type_focal)
-                space[neighbor_position[0],neighbor_position[1]] = type_focal
-
-        # print('----------------------------')
+                set_site(sites, counts, competitor, type_focal)
 
-    return space
+    return sites
 
-def exec_sim(r = 0.6, p1 = 0.6, p2 = 0.8, p3 = 0.5, mu = 0.01, S = 30, years = 10, x0 = 10, proportion = (1/3,1/3,1/3)):
-    mutation = mu
+@njit
+def place_cohort(space, counts, cohort, mutation, order, types, states, stream):
+    """
+    Place cohort[k] individuals of morph k+1 on random sites of the empty
+    lattice space, each one becoming one of the other two morphs with
+    probability mutation
 
-    probabilities = np.array([
-        [r, r, r, r],
-        [r, 1, p1, 0],
-        [r, 0, 1, p2],
-        [r, p3, 0, 1]])
-    size = 30
+    order is a permutation of the flat sites (left shuffled for the next
+    cohort) and types a buffer of at least space.size integers
+    """
+    n = 0
+    for k in range(len(cohort)):
+        types[n:n + cohort[k]] = k + 1
+        n += cohort[k]
+    place_individuals(space.reshape(-1), order, types[:n], counts, states, stream, mutation)
 
-    space = np.zeros((size, size))
+@njit
+def run_years(space, probabilities, neighbours, years, mutation, initial, states, stream, observed, threshold):
+    """
+    Season loop of exec_sim on the lattice space (overwritten), neighbours
+    being its neighbour table and initial the cohort of the first year
 
-    init = x0
+    Given observed fractions of shape (years, 3), the distance to them (mean
+    over the years of the squared error summed over the morphs) is
+    accumulated year by year. The terms are positive, so the run stops as
+    soon as the partial sum exceeds threshold: it cannot be accepted anymore.
 
-    if proportion == (1/3,1/3,1/3):
-        N = np.concatenate((
-            [1 for _ in range(init)],
-            [2 for _ in range(init)],
-            [3 for _ in range(init)]
-        ))
-    else:
-        N = np.concatenate((
-            [1 for _ in range(int(init*proportion[0]))],
-            [2 for _ in range(int(init*proportion[1]))],
-            [3 for _ in range(int(init*proportion[2]))]
-        ))
-
-    N1 = [init]
-    N2 = [init]
-    N3 = [init]
-
-    for n in range(len(N)):
-        ij = np.random.randint(0, size, 2)
-        while space[ij[0], ij[1]] != 0:
-            ij = np.random.randint(0, size, 2)
-        
-        space[ij[0], ij[1]] = N[n]
-
-
-    final_fracN1 = []
-    final_fracN2 = []
-    final_fracN3 = []
+    Returns:
+    - Fraction of each morph at the end of every year, shape (years, 3),
+      NaN for the years not simulated
+    - Distance to the observed fractions (partial if the run stopped early,
+      0 if observed is empty)
+    """
+    sites = space.reshape(-1)
+    counts = np.zeros(4, dtype=np.int64)
+    occupied = np.empty(space.size, dtype=np.int64)
+    order = np.arange(space.size)
+    types = np.empty(space.size, dtype=np.int64)
+    cohort = np.empty(3, dtype=np.int64)
+    end = np.empty(3, dtype=np.int64)
+    fractions = np.full((years, 3), np.nan)
+    distance = 0.0
+    simulated = years
 
     for y in range(years):
-        # print(f"Year: {y}")
         if y%2 == 0:
             N_females = 110
         else:
             N_females = 80
-            
         total_eggs = 6*N_females
+
         if y == 0:
-            init = 10
-            N = np.concatenate((
-                [1 for _ in range(init)],
-                [2 for _ in range(init)],
-                [3 for _ in range(init)]
-            ))
-            N1 = [init]
-            N2 = [init]
-            N3 = [init]
-        
+            cohort[:] = initial
         else:
-            init = 20
-            N = np.concatenate((
-                [1 for _ in range(int(np.round(total_eggs*final_fracN1[-1])))],
-                [2 for _ in range(int(np.round(total_eggs*final_fracN2[-1])))],
-                [3 for _ in range(int(np.round(total_eggs*final_fracN3[-1])))]
-            ))
-            N1 = [int(np.round(total_eggs*final_fracN1[-1]))]
-            N2 = [int(np.round(total_eggs*final_fracN2[-1]))]
-            N3 = [int(np.round(total_eggs*final_fracN3[-1]))]
-        
-        # print(len(N))
-        
-        space = np.zeros((size, size))
-        
-        for n in range(len(N)):
-            ij = np.random.randint(0, size, 2)
-            while space[ij[0], ij[1]] != 0:
-                ij = np.random.randint(0, size, 2)
-
-            r = np.random.uniform(0, 1)
-            # Check if mutation occurs
-            if r < mutation:
-                new_type = np.random.randint(1, 4)
-                while new_type == N[n]:
-                    new_type = np.random.randint(1, 4)
-                    
-                space[ij[0], ij[1]] = new_type
-            else:
-                space[ij[0], ij[1]] = N[n]
-            
+            for k in range(3):
+                cohort[k] = int(np.rint(total_eggs*fractions[y-1, k]))
+
+        space[:] = 0
+        counts[:] = 0
+        counts[0] = space.size
+        place_cohort(space, counts, cohort, mutation, order, types, states, stream)
+
+        # Until the 12th month the year is summarised by its cohort before mutations
+        end[:] = cohort
         for t in range(1,13):
-            space = stochastic_run(space, probabilities, S)
+            stochastic_run(sites, probabilities, neighbours, counts, occupied, states, stream)
             if t%12 == 0:
-                N1.append(len(np.where(space == 1)[0]))
-                N2.append(len(np.where(space == 2)[0]))
-                N3.append(len(np.where(space == 3)[0]))
+                end[:] = counts[1:]
+
+            if counts[1] == sites.size or counts[2] == sites.size or counts[3] == sites.size:
+                break
+
+        fractions[y] = end / end.sum()
 
-            if len(np.where(space == 1)[0]) == size**2 or len(np.where(space == 2)[0]) == size**2 or len(np.where(space == 3)[0]) == size**2:
+        if len(observed) > 0:
+            total = fractions[y].sum()
+            for k in range(3):
+                distance += (fractions[y, k] / total - observed[y, k])**2 / years
+            if distance > threshold:
+                simulated = y + 1
                 break
-                
-        N1 = np.array(N1)
-        N2 = np.array(N2)
-        N3 = np.array(N3)
 
-        total = N1+N2+N3
+    for y in range(simulated):
+        fractions[y] /= fractions[y].sum()
+    return fractions, distance
+
+@njit(parallel=True)
+def run_batch(probabilities, mutations, size, years, cohort, replicates, states, observed, threshold):
+    """
+    Run replicates of every parameter set in parallel on size x size lattices,
+    run k = p*replicates + rep drawing from stream k (observed and threshold
+    as in run_years)
+
+    Returns:
+    - Yearly fractions, shape (parameter sets, replicates, years, 3)
+    - Distances to the observed fractions, shape (parameter sets, replicates)
+    """
+    n_sets = probabilities.shape[0]
+    y = np.empty((n_sets, replicates, years, 3))
+    distances = np.empty((n_sets, replicates))
+    neighbours = neighbour_table(size)
+    for k in prange(n_sets * replicates):
+        p, rep = k // replicates, k % replicates
+        space = np.empty((size, size), dtype=LATTICE_DTYPE)
+        y[p, rep], distances[p, rep] = run_years(space, probabilities[p], neighbours, years, mutations[p], cohort,
+                                                 states, k, observed, threshold)
+    return y, distances
+
+def probability_matrix(r, p1, p2, p3):
+    """
+    probabilities[a, b]: probability that a keeps its site against b, column 0
+    the probability of not reproducing into an empty site
+    """
+    return np.array([
+        [r, r, r, r],
+        [r, 1, p1, 0],
+        [r, 0, 1, p2],
+        [r, p3, 0, 1]])
+
+def initial_cohort(x0, proportion):
+    if proportion == (1/3,1/3,1/3):
+        return np.array([x0, x0, x0], dtype=np.int64)
+    return np.array([int(x0*proportion[0]), int(x0*proportion[1]), int(x0*proportion[2])], dtype=np.int64)
+
+def check_size(S, cohort):
+    """
+    Validate the lattice size S against the initial cohort and the largest yearly one
+
+    Returns:
+    - S as an int
+    """
+    if isinstance(S, bool) or not isinstance(S, (int, np.integer)) or S < 3:
+        raise ValueError(f"The lattice size S must be an integer of at least 3, got {S!r}")
+    largest = max(MAX_COHORT, int(np.sum(cohort)))
+    if S*S < largest:
+        raise ValueError(f"A {S}x{S} lattice cannot hold cohorts of up to {largest} individuals, "
+                         f"S must be at least {int(np.ceil(np.sqrt(largest)))}")
+    return int(S)
+
+def exec_sim(r = 0.6, p1 = 0.6, p2 = 0.8, p3 = 0.5, mu = 0.01, S = 30, years = 10, x0 = 10, proportion = (1/3,1/3,1/3), seed = None):
+    """
+    Simulate the lizard populations over a number of years
+
+    Parameters:
+    - r: Probability of not reproducing into an empty neighbouring site
+    - p1, p2, p3: Probabilities that morph 1 keeps its site against 2, 2 against 3 and 3 against 1
+    - mu: Mutation probability of each egg
+    - S: Size of the periodic S x S lattice, at least 26 to hold the yearly cohorts
+    - years: Number of years
+    - x0, proportion: Cohort of the first year, x0 eggs of each morph, or x0*proportion[k]
+      of morph k+1 for another proportion (mutating like the following cohorts)
+    - seed: Seed of the random stream, for reproducible runs (default: drawn from np.random).
+      The run is the first one of exec_batch with the same seed
+
+    Returns:
+    - space: Final lattice, shape (S, S)
+    - y: Fraction of each morph at the end of every year, shape (years, 3)
+    """
+    states = seed_streams(seed if seed is not None else np.random.randint(2**31), 1)
+    probabilities = probability_matrix(r, p1, p2, p3)
+    cohort = initial_cohort(x0, proportion)
+    S = check_size(S, cohort)
 
-        y = np.array([N1/total, N2/total, N3/total]).T
-        
-        final_fracN1.append(y[-1,0])
-        final_fracN2.append(y[-1,1])
-        final_fracN3.append(y[-1,2])
+    space = np.empty((S, S), dtype=LATTICE_DTYPE)
+    y, _ = run_years(space, probabilities, neighbour_table(S), years, mu, cohort, states, 0, np.empty((0, 3)), np.inf)
 
-    final_fracN1 = np.array(final_fracN1)
-    final_fracN2 = np.array(final_fracN2)
-    final_fracN3 = np.array(final_fracN3)
+    return space, y
 
-    total = final_fracN1+final_fracN2+final_fracN3
+def exec_batch(params, replicates, S = 30, years = 10, x0 = 10, proportion = (1/3,1/3,1/3), seed = None):
+    """
+    Independent replicates of exec_sim for a set of parameter points, run in parallel
 
-    y = np.array([final_fracN1/total, final_fracN2/total, final_fracN3/total]).T
+    Parameters:
+    - params: Array of shape (P, 5) with the parameters r, p1, p2, p3, mu of each
+      point (or a single point of shape (5,))
+    - replicates: Number of replicates R of each point
+    - S, years, x0, proportion: As in exec_sim, shared by all runs
+    - seed: Master seed of the random streams (default: drawn from np.random)
 
-    return space, y
\ No newline at end of file
+    Returns:
+    - y: Fraction of each morph at the end of every year, shape (P, R, years, 3)
+    """
+    params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+    if params.shape[1] != 5:
+        raise ValueError(f"Expected parameter points (r, p1, p2, p3, mu), got shape {params.shape}")
+    cohort = initial_cohort(x0, proportion)
+    S = check_size(S, cohort)
+    states = seed_streams(seed if seed is not None else np.random.randint(2**31), len(params) * replicates)
+    probabilities = np.array([probability_matrix(*point[:4]) for point in params])
+    y, _ = run_batch(probabilities, params[:, 4].copy(), S, years, cohort, replicates, states,
+                     np.empty((0, 3)), np.inf)
+    return y
@@ -1,233 +1,217 @@
-import warnings
-warnings.filterwarnings("ignore")
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap
-import ternary
-import math
-from tqdm import tqdm
-import sys
-import os
-import argparse
-
-parser = argparse.ArgumentParser("PDE solution")
-parser.add_argument("plot", help="If 'yes' snapshots of the simulation will be saved according to the number of snapshots (default=400). Otherwise no plot will be generated.", type=str)
-parser.add_argument("final_time", help="Final time for the simulation to stop.", type=float)
-parser.add_argument("dt", help="Time step size for each simulation step. The total number of steps in the simulation will equal final_time/dt.", type=float)
-parser.add_argument("beta", help="Reproduction rate.", type=float)
-parser.add_argument("sigma", help="Dominance-removal rate.", type=float)
-parser.add_argument("zeta", help="Dominance-replacement rate.", type=float)
-parser.add_argument("mu", help="Mutation rate.", type=float)
-parser.add_argument("delta_D", help="Hopping rate. Hopping is the movement an individual has when it moves from it's local site to a neighboring empty one.", type=float)
-parser.add_argument("delta_E", help="Pair-exchange rate. Pair-exchange is the movement an in individual has when it switches it's local site with it's neighbor's. Compared to hopping, this is understood as movement through crowded areas where the movement of one must displace the other.", type=float)
-parser.add_argument("snapshots", help="(Optional argument) Number of snapshots to save during the simulation.", type=int,
-                    nargs='?', default=400)
-args = parser.parse_args()
-
 """"
     Reference:
         - Szczesny, B., Mobilia, M. & Rucklidge, A. M. (2014). Characterization of spiraling patterns in spatial rock-paper-scissors games. Physical Review E. 90, 032704.
 """
 
-plot = args.plot
-
-if plot == 'y' or plot == 'yes':
-    try:
-        plt.rc('text', usetex=True)
-        plt.rc('font', family='serif')
-    except Exception as e:
-        print("LaTeX not found or not uploaded, using Matplotlib default font.")
-        print(f"Error type: {type(e)}\nError message: {e}")
-
-def color_point(x, y, z, scale):
-    w = 255
-    x_color = x * w / float(scale)
-    y_color = y * w / float(scale)
-    z_color = z * w / float(scale)
-    r = math.fabs(w - y_color) / w
-    g = math.fabs(w - x_color) / w
-    b = math.fabs(w - z_color) / w
-    return (r, g, b, 1.)
-
-
-def generate_heatmap_data(scale=5):
-    from ternary.helpers import simplex_iterator
-    d = dict()
-    for (i, j, k) in simplex_iterator(scale):
-        d[(i, j, k)] = color_point(i, j, k, scale)
-    return d
-
-# Helper functions for Laplacian with periodic boundaries
-def laplacian(Z):
-    return (
-        np.roll(Z, 1, axis=0) + np.roll(Z, -1, axis=0) +
-        np.roll(Z, 1, axis=1) + np.roll(Z, -1, axis=1) -
-        4 * Z
-    ) / dx**2
-
-# Parameters
-beta, sigma, zeta, mu = args.beta, args.sigma, args.zeta, args.mu
-deltaD, deltaE = args.delta_D, args.delta_E
-L = 128  # Grid size (LxL)
-dx = 1.0  # Spatial step
-dt = args.dt  # Time step
-T_final = args.final_time # total time
-T = int(T_final/dt)  # Total time steps
-
-# Grid and initial conditions
-x = np.arange(0, L)
-y = np.arange(0, L)
-X, Y = np.meshgrid(x, y)
-
-# Initialize densities (small random perturbations around coexistence fixed point)
-s1 = beta / (3 * beta + sigma) + 0.01 * np.random.rand(L, L)
-s2 = beta / (3 * beta + sigma) + 0.01 * np.random.rand(L, L)
-s3 = beta / (3 * beta + sigma) + 0.01 * np.random.rand(L, L)
-
-colors = [(0, 1, 1), (1, 0, 1), (1, 1, 0)]  # Cyan, Magenta, Yellow
-ternary_cmap = LinearSegmentedColormap.from_list("TernaryMap", colors, N=256)
-
-# Initialize plot
-fig, axs = plt.subplots(2,2, figsize=(10, 10))
-ax = axs.flatten()
-cbar = None  # Placeholder for the colorbar
-ims = []  # Store images for animation
-
-scale = 100
-data = generate_heatmap_data(scale)
-
-frame = 0
-# Time evolution
-total_density_s1 = []
-total_density_s2 = []
-total_density_s3 = []
-
-if plot == 'y' or plot == 'yes':
-    isExist = os.path.exists('./Frames_PDE')
-    if isExist == False:
-        os.mkdir('./Frames_PDE')
-
-
-for t in tqdm(range(T)):
-    # Total density
-    r = s1 + s2 + s3
-
-    # Compute Laplacians
-    lap_s1 = laplacian(s1)
-    lap_s2 = laplacian(s2)
-    lap_s3 = laplacian(s3)
-    lap_r = laplacian(r)
-
-    # Update equations
-    ds1_dt = (
-        s1 * (beta * (1 - r) - sigma * s3) +
-        zeta * s1 * (s2 - s3) +
-        mu * (s3 + s2 - 2 * s1) +
-        (deltaE - deltaD) * (r * lap_s1 - s1 * lap_r) +
-        deltaD * lap_s1
-    )
-    ds2_dt = (
-        s2 * (beta * (1 - r) - sigma * s1) +
-        zeta * s2 * (s3 - s1) +
-        mu * (s1 + s3 - 2 * s2) +
-        (deltaE - deltaD) * (r * lap_s2 - s2 * lap_r) +
-        deltaD * lap_s2
-    )
-    ds3_dt = (
-        s3 * (beta * (1 - r) - sigma * s2) +
-        zeta * s3 * (s1 - s2) +
-        mu * (s2 + s1 - 2 * s3) +
-        (deltaE - deltaD) * (r * lap_s3 - s3 * lap_r) +
-        deltaD * lap_s3
-    )
-
-    # Euler update
-    s1 += dt * ds1_dt
-    s2 += dt * ds2_dt
-    s3 += dt * ds3_dt
+import warnings
+warnings.filterwarnings("ignore")
+import numpy as np
+import os
+import argparse
 
-    # Ensure densities remain non-negative
-    s1 = np.clip(s1, 0, 1)
-    s2 = np.clip(s2, 0, 1)
-    s3 = np.clip(s3, 0, 1)
+from storage import ResultsWriter
+from gillespie_utils import STOP_EXTINCTION, STOP_CONVERGED
+from pde_utils import initial_densities, run_pde, run_parameters, compare_precision, initial_ensemble, run_ensemble
+
+def main():
+    parser = argparse.ArgumentParser("PDE solution")
+    parser.add_argument("plot", help="If 'yes' snapshots of the simulation will be saved according to the number of snapshots (default=400). If 'raw' the density fields are streamed to Snapshots_PDE.npz, to be rendered later with render_snapshots.py. Otherwise no plot will be generated.", type=str)
+    parser.add_argument("final_time", help="Final time for the simulation to stop.", type=float)
+    parser.add_argument("dt", help="Time step size for each simulation step. The total number of steps in the simulation will equal final_time/dt.", type=float)
+    parser.add_argument("beta", help="Reproduction rate.", type=float)
+    parser.add_argument("sigma", help="Dominance-removal rate.", type=float)
+    parser.add_argument("zeta", help="Dominance-replacement rate.", type=float)
+    parser.add_argument("mu", help="Mutation rate.", type=float)
+    parser.add_argument("delta_D", help="Hopping rate. Hopping is the movement an individual has when it moves from it's local site to a neighboring empty one.", type=float)
+    parser.add_argument("delta_E", help="Pair-exchange rate. Pair-exchange is the movement an in individual has when it switches it's local site with it's neighbor's. Compared to hopping, this is understood as movement through crowded areas where the movement of one must displace the other.", type=float)
+    parser.add_argument("snapshots", help="(Optional argument) Number of snapshots to save during the simulation.", type=int,
+                        nargs='?', default=400)
+    parser.add_argument("--method", help="'euler' (default) for explicit Euler steps, 'etd2' for the exponential time differencing scheme, which integrates the diffusion exactly in Fourier space and allows much larger dt, or 'rk23' for adaptive Runge-Kutta steps with error control, dt being then only the interval between outputs.", type=str, default='euler', choices=['euler', 'etd2', 'rk23'])
+    parser.add_argument("--rtol", help="(rk23) Relative tolerance of the local error (default=1e-3).", type=float, default=1e-3)
+    parser.add_argument("--atol", help="(rk23) Absolute tolerance of the local error (default=1e-6).", type=float, default=1e-6)
+    parser.add_argument("--L", help="Grid size, the grid has L x L sites (default=128).", type=int, default=128)
+    parser.add_argument("--dx", help="Spatial step (default=1).", type=float, default=1.0)
+    parser.add_argument("--dtype", help="Precision of the fields, 'float64' (default) or 'float32', which halves memory and bandwidth.", type=str, default='float64', choices=['float64', 'float32'])
+    parser.add_argument("--strips", help="(Euler) Cut the grid into this number of strips of rows, advanced in parallel with halo exchange. The results are identical to the single-domain run (default=no decomposition).", type=int, default=None)
+    parser.add_argument("--workers", help="(Euler with --strips) Number of threads (default=one per strip).", type=int, default=None)
+    parser.add_argument("--ensemble", help="(Euler) Number of independent realisations advanced together. The fractions and final fields of all of them are saved to Result_ensemble_PDE.npz, no plot is made. Strips, spectra, stopping criteria and checkpoints are not available in this mode (default=single run).", type=int, default=None)
+    parser.add_argument("--record_every", help="Record the species fractions every k steps (default=1).", type=int, default=1)
+    parser.add_argument("--spectra", help="At every snapshot, store the radially averaged structure factor and two-point correlation of the fields, with the correlation length and spiral wavelength, in the results file.", action='store_true')
+    parser.add_argument("--extinction_threshold", help="Stop once the fraction of a species falls below this value (default=disabled).", type=float, default=None)
+    parser.add_argument("--converge_window", help="Stop once the fractions of all species stayed within --converge_tol over this number of records, checked every converge_window records (default=0, disabled).", type=int, default=0)
+    parser.add_argument("--converge_tol", help="Tolerance (max - min of each fraction) of the convergence criterion (default=1e-3).", type=float, default=1e-3)
+    parser.add_argument("--checkpoint", help="File where the state of the run (fields, step, records and integrator state) is saved periodically and at the end (default=no checkpoints).", type=str, default=None)
+    parser.add_argument("--checkpoint_every", help="Steps between checkpoints (default=only at the end).", type=int, default=None)
+    parser.add_argument("--restart", help="Resume the run saved in this checkpoint file, with the same parameters. The densities in the results file again cover the whole run, snapshots and spectra only the resumed part.", type=str, default=None)
+    parser.add_argument("--seed", help="Seed of the random initial densities, for reproducible runs (default=random, stored in the results file).", type=int, default=None)
+    parser.add_argument("--check_precision", help="Instead of the simulation, report the divergence between float32 and float64 runs of the same trajectory.", action='store_true')
+    args = parser.parse_args()
     
-    total_density_s1.append(np.sum(s1)/np.sum(r))
-    total_density_s2.append(np.sum(s2)/np.sum(r))
-    total_density_s3.append(np.sum(s3)/np.sum(r))
-
-    # Visualization
-    if plot == 'y' or plot == 'yes':
-        if t % (T/args.snapshots) == 0:
-            ax[0].clear()
-            ax[3].clear()
-            
-            total = s1 + s2 + s3
-            norm_s1 = s1 / total
-            norm_s2 = s2 / total
-            norm_s3 = s3 / total
-
-            # Create RGB image
-            ternary_image = np.stack((norm_s1, norm_s2, norm_s3), axis=-1)
-            ternary_image = ternary_image @ np.array(colors)
-
-            # Plot
-            ax[0].imshow(ternary_image, interpolation='nearest')
-            ax[0].set_title(f"Species Densities at t={t * dt:.1f}", fontsize = 14)
-            ax[0].axis('off')
-            
-            ax[3].plot([i*dt for i in range(t+1)], total_density_s1, color = 'cyan', lw = 2, label = 'Type 1')
-            ax[3].plot([i*dt for i in range(t+1)], total_density_s2, color = 'magenta', lw = 2, label = 'Type 2')
-            ax[3].plot([i*dt for i in range(t+1)], total_density_s3, color = 'yellow', lw = 2, label = 'Type 3')
-            ax[3].set_ylim(0, 1)
-            ax[3].set_xlim(0, T_final)
-            ax[3].set_title("Total densities", fontsize = 14)
-            ax[3].set_xlabel("Time", fontsize = 12)
-            ax[3].set_ylabel("Fraction of total", fontsize = 12)
-            ax[3].legend(loc = 'upper center', ncol = 3)
-            ax[3].patch.set_facecolor("gray")
-            
-            if frame == 0:
-                figure, tax = ternary.figure(scale=scale, ax = ax[1])
-                tax.heatmap(data, style="hexagonal", use_rgba=True, colorbar = False)
-                tax.ticks(axis='lbr', multiple=20, linewidth=1, tick_formats="%.0f", offset=0.02,
-                        fontsize = 9)
-                tax.left_axis_label("Type 3 [\%]", fontsize=12, offset = 0.12)
-                tax.right_axis_label("Type 1 [\%]", fontsize=12, offset = 0.12)
-                tax.bottom_axis_label("Type 2 [\%]", fontsize=12, offset = 0.12)
-                tax.boundary()
-                tax.get_axes().axis('off')
-                
-                ax[2].set_ylim(0, 1)
-                ax[2].set_xlim(0, 1)
-                ax[2].axis('off')
-                ax[2].text(0.05, 0.95, r'$\displaystyle \partial_t s_i = s_i [ \underbrace{\beta \left( 1 - r \right)}_{\mathrm{reproduction}} - \underbrace{\sigma s_{i-1}}_{\mathrm{dominance-removal}} ]$',
-                        ha = 'left', fontsize = 14)
-                ax[2].text(0.05, 0.8, r'$+ \underbrace{\xi s_i \left( s_{i+1} − s_{i−1} \right)}_{\mathrm{dominance-replacement}}$', ha = 'left', fontsize = 14)
-                ax[2].text(0.05, 0.65, r'$+ \underbrace{\mu \left( s_{i−1} + s_{i+1} − 2 s_i \right)}_{\mathrm{mutation}}$',
-                        ha = 'left', fontsize = 14)
-                ax[2].text(0.05, 0.5, r'$+ \underbrace{\left(\delta_E − \delta_D \right) \left[r \nabla^2 s_i − s_i \nabla^2 r \right]}_{\mathrm{non-linear-mobility}}$',
-                        ha = 'left', fontsize = 14)
-                ax[2].text(0.05, 0.35, r'$+ \underbrace{\delta_D \nabla^2 s_i}_{\mathrm{diffusion}}$',
-                        ha = 'left', fontsize = 12)
-                ax[2].text(0.05, 0.2, r'$r = s_1 + s_2 + s_3$',
-                        ha = 'left', fontsize = 12)
-                
-                ax[2].patch.set_facecolor('#cfcfcf')
-
-            fig.patch.set_facecolor('#cfcfcf')
-
-            plt.savefig(f'./Frames_PDE/PDE_frame_{frame}.png', dpi = 90, bbox_inches = 'tight')
-            frame += 1
-
-final_lattice = np.array([s1,s2,s3])
-result_densities = np.array([total_density_s1,total_density_s2,total_density_s3])
-
-print("\nSimulation finished!")
-print("\n")
-print(f"Lattice file shape: {final_lattice.shape}")
-print(f"Densities file shape: {result_densities.shape}")
-
-np.savetxt('Result_densities_PDE.txt', result_densities)
-np.savetxt('Result_lattice_1_PDE.txt', final_lattice[0])
-np.savetxt('Result_lattice_2_PDE.txt', final_lattice[1])
-np.savetxt('Result_lattice_3_PDE.txt', final_lattice[2])
\ No newline at end of file
+    plot = args.plot
+    
+    # Parameters
+    beta, sigma, zeta, mu = args.beta, args.sigma, args.zeta, args.mu
+    deltaD, deltaE = args.delta_D, args.delta_E
+    L = args.L  # Grid size (LxL)
+    dx = args.dx  # Spatial step
+    dt = args.dt  # Time step
+    T_final = args.final_time # total time
+    T = int(T_final/dt)  # Total time steps
+    
+    if args.check_precision:
+        report = compare_precision(L, T, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx, method=args.method,
+                                   seed=args.seed if args.seed is not None else 0)
+        print(f"{'Time':>10} {'Max abs diff':>14} {'Relative L2':>14}")
+        for t, max_abs, rel_l2 in zip(report['time'], report['max_abs'], report['rel_l2']):
+            print(f"{t:10.2f} {max_abs:14.3e} {rel_l2:14.3e}")
+        print(f"Maximum difference of the species fractions: {report['fractions_max_abs']:.3e}")
+        return
+    
+    # Seed actually used, stored with the results so that the run can be reproduced
+    seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy % 2**31)
+    
+    # Invalid arguments and checkpoints are reported before any file is written
+    if args.record_every < 1:
+        parser.error("--record_every must be a positive number of steps")
+    if args.ensemble is not None:
+        if args.method != 'euler':
+            parser.error("--ensemble is only available for the 'euler' method")
+        unsupported = [f"--{name}" for name in ('strips', 'workers', 'spectra', 'extinction_threshold', 'converge_window',
+                                                'checkpoint', 'checkpoint_every', 'restart')
+                       if getattr(args, name) != parser.get_default(name)]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --ensemble")
+    if args.strips is not None and (args.method != 'euler' or not 1 <= args.strips <= L):
+        parser.error(f"--strips is only available for the 'euler' method, with 1 to L = {L} strips")
+    start = 0
+    if args.restart is not None:
+        from storage import load_checkpoint
+        start = load_checkpoint(args.restart, run_parameters(
+            L, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx, args.method, args.rtol, args.atol,
+            args.dtype, args.record_every))[1]['step']
+    np.random.seed(seed)
+    metadata = dict(vars(args), seed=seed, model='Szczesny PDE', steps=T)
+    
+    if args.ensemble is not None:
+        s = initial_ensemble(args.ensemble, L, beta, sigma, dtype=args.dtype)
+        fields, densities = run_ensemble(s, T, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx, progress=True,
+                                         record_every=args.record_every)
+        
+        final = densities[:, :, -1]
+        print("\nSimulation finished!")
+        print(f"Final fractions over {args.ensemble} realisations (mean +- std): " +
+              ", ".join(f"{m:.4f} +- {d:.4f}" for m, d in zip(final.mean(axis=0), final.std(axis=0))))
+        with ResultsWriter('Result_ensemble_PDE.npz', metadata) as results:
+            results.write('densities', densities)
+            results.write('fields', fields)
+        return
+    
+    # Initialize densities (small random perturbations around coexistence fixed point)
+    s1, s2, s3 = initial_densities(L, beta, sigma, dtype=args.dtype)
+    
+    # The records are written to the results file at every snapshot, which leaves it readable with
+    # the records so far if the job is killed, and completed with them if the run fails or is
+    # interrupted. The final fields is added at the end.
+    with ResultsWriter('Result_PDE.npz', metadata) as results:
+        series = results.series('densities', (3,))
+        written = 0
+        
+        spectra = None
+        if args.spectra:
+            from analysis import SpectrumSeries
+            spectra = SpectrumSeries(results, L, dx)
+        
+        def save_densities(recorder):
+            nonlocal written
+            series.extend(recorder.fractions[written:], recorder.t[written:])
+            written = recorder.size
+        
+        draw = None
+        writer = None
+        if plot == 'y' or plot == 'yes':
+            import matplotlib.pyplot as plt
+            from plots import draw_pde_frame, generate_heatmap_data
+        
+            try:
+                plt.rc('text', usetex=True)
+                plt.rc('font', family='serif')
+            except Exception as e:
+                print("LaTeX not found or not uploaded, using Matplotlib default font.")
+                print(f"Error type: {type(e)}\nError message: {e}")
+        
+            isExist = os.path.exists('./Frames_PDE')
+            if isExist == False:
+                os.mkdir('./Frames_PDE')
+        
+            # Initialize plot
+            fig, axs = plt.subplots(2,2, figsize=(10, 10))
+            ax = axs.flatten()
+            scale = 100
+            data = generate_heatmap_data(scale)
+            snapshot_every = T/args.snapshots
+            frame = sum(1 for t in range(start) if t % snapshot_every == 0)
+        
+            def draw(t, s1, s2, s3, recorder):
+                nonlocal frame
+                draw_pde_frame(fig, ax, (s1, s2, s3), (t + 1) * dt, recorder.t, recorder.fractions.T,
+                               frame, T_final, data, scale)
+                plt.savefig(f'./Frames_PDE/PDE_frame_{frame}.png', dpi = 90, bbox_inches = 'tight')
+                frame += 1
+        elif plot == 'raw':
+            from storage import ChunkedArrayWriter
+        
+            # Raw fields are compressed and written by a background thread, rendering is done offline
+            # A restarted run does not overwrite the snapshots taken before the checkpoint
+            path = 'Snapshots_PDE.npz' if start == 0 else f'Snapshots_PDE_from_{start}.npz'
+            writer = ChunkedArrayWriter(path, (3, L, L), s1.dtype)
+        
+            def draw(t, s1, s2, s3, recorder):
+                # Fields after step t, at the time the recorder gives them
+                writer.append((s1, s2, s3), (t + 1) * dt)
+        
+        def callback(t, s1, s2, s3, recorder):
+            save_densities(recorder)
+            if spectra is not None:
+                spectra.append((s1, s2, s3), (t + 1) * dt)
+            results.sync()
+            if draw is not None:
+                draw(t, s1, s2, s3, recorder)
+        
+        # Time evolution
+        stats = {}
+        try:
+            s1, s2, s3, result_densities, status = run_pde(s1, s2, s3, T, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx,
+                                                           snapshot_every=T/args.snapshots, callback=callback, progress=True,
+                                                           method=args.method, rtol=args.rtol, atol=args.atol, stats=stats,
+                                                           strips=args.strips, workers=args.workers, record_every=args.record_every,
+                                                           checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every,
+                                                           restart=args.restart, extinction_threshold=args.extinction_threshold,
+                                                           converge_window=args.converge_window, converge_tol=args.converge_tol)
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        final_lattice = np.array([s1,s2,s3])
+        # Records after the last snapshot, record k being taken after step (k+1)*record_every
+        series.extend(result_densities.T[written:],
+                      (np.arange(written, result_densities.shape[1]) + 1) * args.record_every * dt)
+        results.write('fields', final_lattice)
+        results.write('status', status)
+    
+    if status == STOP_EXTINCTION:
+        print(f"\nA species went extinct at t = {result_densities.shape[1] * args.record_every * dt:.3f}.")
+    elif status == STOP_CONVERGED:
+        print(f"\nThe densities converged at t = {result_densities.shape[1] * args.record_every * dt:.3f}.")
+    print("\nSimulation finished!")
+    if args.method == 'rk23':
+        print(f"Adaptive steps: {stats['accepted']} accepted, {stats['rejected']} rejected, {stats['evaluations']} evaluations of the equations")
+    print("\n")
+    print(f"Lattice shape: {final_lattice.shape}")
+    print(f"Densities shape: {result_densities.shape}")
+    if spectra is not None:
+        _, _, length, wavelength = spectra.last
+        print(f"Last snapshot: correlation length {length:.3f}, wavelength {wavelength:.3f}")
+    print(f"Results saved to {results.path}")
+
+if __name__ == '__main__':
+    main()
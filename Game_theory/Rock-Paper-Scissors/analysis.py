@@ -0,0 +1,149 @@
+"""
+    Spatial observables of the rock-paper-scissors patterns, computed
+    during the run instead of post-processing stored lattices.
+
+    For each species a the density fluctuation d_a(x) = a(x) - <a> is taken,
+    a(x) being the PDE field s_a or, for the lattice, the indicator of the
+    sites occupied by species a. With F_a its discrete Fourier transform and
+    N the number of sites:
+
+        structure factor      S(k) = sum_a |F_a(k)|^2 / N
+        two-point correlation C(r) = sum_a <d_a(x) d_a(x + r)> / sum_a <d_a^2>
+
+    both averaged over shells of |k| (resp. |r|, minimum image on the
+    periodic domain) one grid unit thick, up to half the domain. By the
+    Wiener-Khinchin theorem C is the inverse transform of the spectrum, so a
+    single real FFT per species gives both. From them:
+
+    - correlation length: distance at which C(r) first drops below 1/e,
+      interpolated linearly between shells
+    - wavelength: 2 pi / k*, k* being the wavenumber of the maximum of S(k)
+      (k = 0 excluded), i.e. the typical spiral arm spacing
+
+    A spectrum is O(L) numbers against the L^2 of a snapshot.
+
+    Reference:
+    - Reichenbach, T., Mobilia, M., & Frey, E. (2007). Noise and correlations in a spatial population model with cyclic competition. Physical review letters, 99(23), 238105.
+"""
+
+import numpy as np
+
+class SpectrumAnalyzer:
+    """
+    Radially averaged structure factor and correlation function of L x L
+    periodic fields. The shell of every wavevector and distance is computed
+    once, so each analysis costs the FFTs and two bincounts.
+
+    Parameters:
+    - L: Grid size
+    - dx: Spatial step (1 for the lattice)
+    """
+    def __init__(self, L, dx=1.0):
+        self.L = L
+        self.dx = dx
+        self.n_shells = L // 2 + 1
+
+        # Wavevectors of the real FFT: the columns 0 < kx < L/2 stand for two
+        # conjugate modes each, so they count twice in the shell averages
+        kx = np.arange(L // 2 + 1)
+        ky = np.fft.fftfreq(L, 1.0 / L)
+        k_index = np.rint(np.hypot(ky[:, None], kx[None, :])).astype(np.int64)
+        weights = np.full(kx.shape, 2.0)
+        weights[0] = 1.0
+        if L % 2 == 0:
+            weights[-1] = 1.0
+        self._k_weights = np.broadcast_to(weights, k_index.shape).ravel()
+        self._k_shell = k_index.ravel()
+        self._k_count = np.bincount(self._k_shell, self._k_weights, minlength=self.n_shells)[:self.n_shells]
+
+        # Minimum-image distances of the autocorrelation
+        r = np.minimum(np.arange(L), L - np.arange(L))
+        self._r_shell = np.rint(np.hypot(r[:, None], r[None, :])).astype(np.int64).ravel()
+        self._r_count = np.bincount(self._r_shell, minlength=self.n_shells)[:self.n_shells]
+
+        self.wavenumbers = 2 * np.pi * np.arange(self.n_shells) / (L * dx)
+        self.distances = np.arange(self.n_shells) * dx
+
+    def _shell_average(self, values, shell, count, weights=None):
+        if weights is not None:
+            values = weights * values
+        return np.bincount(shell, values, minlength=self.n_shells)[:self.n_shells] / count
+
+    def analyze(self, fields):
+        """
+        Spectrum and correlation of a stack of fields
+
+        Parameters:
+        - fields: Array (species, L, L), e.g. (s1, s2, s3) or indicators(space)
+
+        Returns:
+        - structure_factor: S(k) at self.wavenumbers
+        - correlation: C(r) at self.distances, C(0) = 1
+        - correlation_length: Distance at which C(r) falls below 1/e (nan if it never does)
+        - wavelength: 2 pi / k at the maximum of S(k > 0) (nan for uniform fields)
+        """
+        fields = np.asarray(fields, dtype=np.float64)
+        n_sites = self.L * self.L
+        fluctuations = fields - fields.mean(axis=(-2, -1), keepdims=True)
+        power = np.sum(np.abs(np.fft.rfft2(fluctuations)) ** 2, axis=0) / n_sites
+        autocorrelation = np.fft.irfft2(power, s=(self.L, self.L)).ravel()
+
+        structure_factor = self._shell_average(power.ravel(), self._k_shell, self._k_count, self._k_weights)
+        variance = autocorrelation[0]
+        if variance <= 0:
+            return structure_factor, np.full(self.n_shells, np.nan), np.nan, np.nan
+        correlation = self._shell_average(autocorrelation, self._r_shell, self._r_count) / variance
+        return structure_factor, correlation, self.correlation_length(correlation), self.wavelength(structure_factor)
+
+    def correlation_length(self, correlation):
+        below = np.flatnonzero(correlation < np.exp(-1))
+        if len(below) == 0:
+            return np.nan
+        i = below[0]
+        c0, c1 = correlation[i - 1], correlation[i]
+        return (i - 1 + (c0 - np.exp(-1)) / (c0 - c1)) * self.dx
+
+    def wavelength(self, structure_factor):
+        peak = 1 + np.argmax(structure_factor[1:])
+        if structure_factor[peak] <= 0:
+            return np.nan
+        return 2 * np.pi / self.wavenumbers[peak]
+
+def indicators(space, n_species=3):
+    """
+    Occupation fields of the lattice species 1..n_species, shape (species, L, L)
+    """
+    return np.stack([space == a for a in range(1, n_species + 1)]).astype(np.float64)
+
+class SpectrumSeries:
+    """
+    Results-file series of the spatial observables: the spectra under
+    'structure_factor' and 'correlation', correlation length and wavelength
+    under 'correlation_length' and 'wavelength', the axes as the arrays
+    'wavenumbers' and 'distances'.
+
+    Parameters:
+    - results: Open ResultsWriter
+    - L, dx: Grid of the fields
+    """
+    def __init__(self, results, L, dx=1.0):
+        self.analyzer = SpectrumAnalyzer(L, dx)
+        n = self.analyzer.n_shells
+        self._structure_factor = results.series('structure_factor', (n,), chunk_size=256)
+        self._correlation = results.series('correlation', (n,), chunk_size=256)
+        self._length = results.series('correlation_length')
+        self._wavelength = results.series('wavelength')
+        results.write('wavenumbers', self.analyzer.wavenumbers)
+        results.write('distances', self.analyzer.distances)
+        self.last = None
+
+    def append(self, fields, t):
+        """
+        Analyse the fields at time t and add the result to the series
+        """
+        self.last = self.analyzer.analyze(fields)
+        structure_factor, correlation, length, wavelength = self.last
+        self._structure_factor.append(structure_factor, t)
+        self._correlation.append(correlation, t)
+        self._length.append(length, t)
+        self._wavelength.append(wavelength, t)
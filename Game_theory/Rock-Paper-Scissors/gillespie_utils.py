@@ -0,0 +1,611 @@
+"""
+    Kernels for the lattice Gillespie simulation of the rock-paper-scissors game.
+
+    Reference:
+    - Reichenbach, T., Mobilia, M. & Frey, E. Mobility promotes and jeopardizes biodiversity in rock–paper–scissors games. Nature 448, 1046–1049 (2007).
+"""
+
+import numpy as np
+from numba import njit
+
+from lattice_utils import LATTICE_DTYPE, OPPOSITE, neighbour_table, neighbour, place_individuals
+from rng_utils import seed_streams
+
+# Classes of directed pairs (focal site -> neighbour)
+PAIR_NONE = 0   # Focal site empty or both sites of the same species
+PAIR_EMPTY = 1  # Occupied focal site next to an empty site (reproduction, hopping)
+PAIR_MIXED = 2  # Two different species (competition, pair-exchange)
+
+# Reasons for run_events to return control to Python
+STOP_BUDGET = 0      # Requested number of events or Monte Carlo steps reached
+STOP_BUFFER_FULL = 1 # Trajectory buffers are full and must grow
+STOP_ABSORBING = 2   # No reaction can happen anymore
+STOP_EXTINCTION = 3  # A species died out
+STOP_CONVERGED = 4   # The fractions stayed within the tolerance over the last window of records
+
+# Pair class each reaction acts on. Reaction orders: competition, pair-exchange, reproduction, hopping
+REACTION_CLASS = np.array([PAIR_MIXED, PAIR_MIXED, PAIR_EMPTY, PAIR_EMPTY])
+
+@njit
+def numba_choice(n, p):
+    """
+    Numba-compatible version of np.random.choice
+
+    Parameters:
+    - n: Number of possible choices
+    - p: Probability weights (will be normalized)
+
+    Returns:
+    - Selected index
+    """
+    # Normalize probabilities
+    p_norm = p / np.sum(p)
+
+    # Generate cumulative probabilities
+    cumulative_p = np.cumsum(p_norm)
+
+    # Random uniform draw
+    r = np.random.random()
+
+    # Find the first index where cumulative prob exceeds random draw
+    for i in range(n):
+        if r <= cumulative_p[i]:
+            return i
+
+    # Fallback (should rarely happen due to normalization)
+    return n - 1
+
+def random_lattice(size, initial_density=0.5, exact=False):
+    """
+    Lattice where each site is occupied with probability initial_density
+    by one of the three species, chosen with equal probability
+
+    With exact set, exactly round(initial_density*size**2) sites are
+    occupied instead, on distinct random sites (see place_individuals)
+    """
+    if exact:
+        n = int(round(initial_density*size*size))
+        sites = np.zeros(size*size, dtype=LATTICE_DTYPE)
+        counts = np.zeros(4, dtype=np.int64)
+        counts[0] = sites.size
+        place_individuals(sites, np.arange(sites.size), np.random.randint(1, 4, n), counts,
+                          seed_streams(np.random.randint(2**31), 1), 0)
+        return sites.reshape(size, size)
+    occupied = np.random.uniform(0, 1, (size, size)) < initial_density
+    return np.where(occupied, np.random.randint(1, 4, (size, size)), 0).astype(LATTICE_DTYPE)
+
+@njit(inline='always')
+def classify(focal, neighbor):
+    """
+    Class of a directed pair from the content of its two sites
+    """
+    if focal == 0:
+        return PAIR_NONE
+    if neighbor == 0:
+        return PAIR_EMPTY
+    if neighbor != focal:
+        return PAIR_MIXED
+    return PAIR_NONE
+
+@njit(inline='always')
+def pair_type(sites, neighbours, i, d):
+    """
+    Class of the directed pair formed by site i and its neighbour in direction d
+    """
+    return classify(sites[i], sites[neighbour(neighbours, i, d)])
+
+@njit
+def rates_from_counts(class_counts, sigma=1.0, epsilon=5.0, mu=1.0, D=5.0):
+    """
+    Global reaction rates from the number of directed pairs in each class
+
+    Returns:
+    - Rates of competition, pair-exchange, reproduction and hopping
+    """
+    rates = np.zeros(4)
+    rates[0] = sigma * class_counts[PAIR_MIXED]
+    rates[1] = epsilon * class_counts[PAIR_MIXED]
+    rates[2] = mu * class_counts[PAIR_EMPTY]
+    rates[3] = D * class_counts[PAIR_EMPTY]
+    return rates
+
+@njit(inline='always')
+def member_index(n_pairs, c, slot):
+    """
+    Position in pair_members of the given slot of the set of class c. The
+    PAIR_EMPTY set grows from the start of the array and the PAIR_MIXED set
+    from its end, as a pair belongs to at most one of them.
+    """
+    if c == PAIR_EMPTY:
+        return slot
+    return n_pairs - 1 - slot
+
+@njit
+def init_pair_state(sites, neighbours):
+    """
+    Build the bookkeeping structures of the lattice with a full scan.
+    This is the only O(L^2) operation, afterwards the structures are
+    kept up to date by update_site.
+
+    The active pairs of each class are stored in an array-backed set:
+    the ids (i*8 + d) of its class_counts[c] pairs are in pair_members (see
+    member_index) and pair_position gives the slot of each pair inside its
+    set, so pairs are inserted, removed (swap with the last one) and sampled
+    in constant time.
+
+    Parameters:
+    - sites: Flat view of the lattice grid
+    - neighbours: Neighbour table from lattice_utils.neighbour_table
+
+    Returns:
+    - pair_class: Class of each directed pair, indexed as [site, direction]
+    - pair_members: Ids of the pairs in the PAIR_EMPTY and PAIR_MIXED sets
+    - pair_position: Slot of each pair in the set of its class, indexed as [site, direction]
+    - class_counts: Number of directed pairs in each class
+    - species_counts: Number of sites holding each type (index 0 counts empty sites)
+    """
+    n_sites = sites.shape[0]
+    n_pairs = n_sites*8
+    pair_class = np.zeros((n_sites, 8), dtype=np.int8)
+    pair_members = np.zeros(n_pairs, dtype=np.int32)
+    pair_position = np.full((n_sites, 8), -1, dtype=np.int32)
+    class_counts = np.zeros(3, dtype=np.int64)
+    species_counts = np.zeros(4, dtype=np.int64)
+
+    for i in range(n_sites):
+        species_counts[sites[i]] += 1
+        for d in range(8):
+            c = pair_type(sites, neighbours, i, d)
+            pair_class[i, d] = c
+            if c != PAIR_NONE:
+                pair_members[member_index(n_pairs, c, class_counts[c])] = i*8 + d
+                pair_position[i, d] = class_counts[c]
+            class_counts[c] += 1
+
+    return pair_class, pair_members, pair_position, class_counts, species_counts
+
+@njit
+def compute_global_rates(space, sigma=1.0, epsilon=5.0, mu=1.0, D=5.0):
+    """
+    Compute global reaction rates with a full scan of the lattice.
+    Kept as a reference to validate the incremental bookkeeping.
+
+    Parameters:
+    - space: Lattice grid
+    - sigma: Competition rate
+    - epsilon: Pair-exchange rate
+    - mu: Reproduction rate
+    - D: Hopping rate
+
+    Returns:
+    - Global reaction rates (competition, pair-exchange, reproduction, hopping)
+    """
+    neighbours = neighbour_table(space.shape[0])
+    _, _, _, class_counts, _ = init_pair_state(space.ravel(), neighbours)
+    return rates_from_counts(class_counts, sigma, epsilon, mu, D)
+
+@njit(inline='always')
+def _set_pair(pair_class, pair_members, pair_position, class_counts, i, d, new_class):
+    old_class = pair_class[i, d]
+    if old_class == new_class:
+        return
+    n_pairs = pair_members.shape[0]
+
+    if old_class != PAIR_NONE:
+        # Swap-remove: the last pair of the set takes the freed slot
+        slot = pair_position[i, d]
+        last = pair_members[member_index(n_pairs, old_class, class_counts[old_class] - 1)]
+        pair_members[member_index(n_pairs, old_class, slot)] = last
+        pair_position[last // 8, last % 8] = slot
+        pair_position[i, d] = -1
+    class_counts[old_class] -= 1
+
+    if new_class != PAIR_NONE:
+        pair_members[member_index(n_pairs, new_class, class_counts[new_class])] = i*8 + d
+        pair_position[i, d] = class_counts[new_class]
+    class_counts[new_class] += 1
+
+    pair_class[i, d] = new_class
+
+@njit
+def update_site(sites, neighbours, i, pair_class, pair_members, pair_position, class_counts):
+    """
+    Refresh the 8 pairs leaving site i and the 8 pairs arriving at it
+    after its content changed. Only the 3x3 neighbourhood is visited.
+    """
+    focal = sites[i]
+    for d in range(8):
+        n = neighbour(neighbours, i, d)
+        # Most pairs keep their class, check before paying for the call
+        c = classify(focal, sites[n])
+        if c != pair_class[i, d]:
+            _set_pair(pair_class, pair_members, pair_position, class_counts, i, d, c)
+        o = OPPOSITE[d]
+        c = classify(sites[n], focal)
+        if c != pair_class[n, o]:
+            _set_pair(pair_class, pair_members, pair_position, class_counts, n, o, c)
+
+@njit
+def set_site(sites, neighbours, i, value, pair_class, pair_members, pair_position, class_counts, species_counts):
+    """
+    Change the content of site i keeping all counts consistent
+    """
+    old = sites[i]
+    if old == value:
+        return
+    species_counts[old] -= 1
+    species_counts[value] += 1
+    sites[i] = value
+    update_site(sites, neighbours, i, pair_class, pair_members, pair_position, class_counts)
+
+@njit
+def sample_pair(pair_members, class_counts, selected_class):
+    """
+    Draw a directed pair uniformly among the ones of a given class in constant time
+
+    Returns:
+    - Focal site and direction of the pair
+    """
+    slot = np.random.randint(class_counts[selected_class])
+    p = pair_members[member_index(pair_members.shape[0], selected_class, slot)]
+    return p // 8, p % 8
+
+@njit
+def gillespie_lattice_step(sites, neighbours, pair_class, pair_members, pair_position, class_counts, species_counts, sigma=1.0, mu=1.0, epsilon=5.0, D=5.0):
+    """
+    Perform a single Gillespie algorithm step on the lattice
+
+    Parameters:
+    - sites: Flat view of the lattice grid, updated in place
+    - neighbours: Neighbour table from lattice_utils.neighbour_table
+    - pair_class, pair_members, pair_position, class_counts, species_counts: Bookkeeping from init_pair_state, updated in place
+    - sigma: Competition rate
+    - mu: Reproduction rate
+    - epsilon: Pair-exchange rate
+    - D: Hopping rate
+
+    Returns:
+    - Time step of the reaction (zero in an absorbing state, where no reaction can happen)
+    - Corresponding increment of Monte Carlo steps (time step divided by the population)
+    """
+    rates = rates_from_counts(class_counts, sigma, epsilon, mu, D)
+
+    population = float(sites.shape[0] - species_counts[0])
+
+    # Total rate
+    total_rate = np.sum(rates)
+
+    # Absorbing state, no reaction can happen
+    if total_rate <= 0:
+        return 0.0, 0.0
+
+    # Generate time step
+    tau = np.random.exponential(1/total_rate)
+
+    # Select reaction and the pair it acts on
+    reaction_index = numba_choice(len(rates), p=rates/total_rate)
+    i1, d = sample_pair(pair_members, class_counts, REACTION_CLASS[reaction_index])
+    i2 = neighbour(neighbours, i1, d)
+    type1, type2 = sites[i1], sites[i2]
+
+    if reaction_index == 0:
+        # Competitive interaction: A beats B, B beats C and C beats A
+        if (type2 - type1) % 3 == 1:
+            set_site(sites, neighbours, i2, 0, pair_class, pair_members, pair_position, class_counts, species_counts)  # Loser is removed
+        else:
+            set_site(sites, neighbours, i1, 0, pair_class, pair_members, pair_position, class_counts, species_counts)  # Focal species is removed
+
+    elif reaction_index == 2:
+        # Reproduce to empty site
+        set_site(sites, neighbours, i2, type1, pair_class, pair_members, pair_position, class_counts, species_counts)
+
+    else:
+        # Hopping or pair-exchange
+        set_site(sites, neighbours, i1, type2, pair_class, pair_members, pair_position, class_counts, species_counts)
+        set_site(sites, neighbours, i2, type1, pair_class, pair_members, pair_position, class_counts, species_counts)
+
+    return tau, tau/population
+
+@njit(nogil=True)
+def window_converged(populations, n_records, window, tol):
+    """
+    Whether the fraction of every species stayed within tol (max - min)
+    over the records n_records-window to n_records-1
+
+    Parameters:
+    - populations: Recorded populations, shape (species, records)
+    """
+    if n_records < window:
+        return False
+    n_species = populations.shape[0]
+    for k in range(n_species):
+        low, high = np.inf, -np.inf
+        for j in range(n_records - window, n_records):
+            total = 0.0
+            for m in range(n_species):
+                total += populations[m, j]
+            fraction = populations[k, j] / total if total > 0 else 0.0
+            low = min(low, fraction)
+            high = max(high, fraction)
+        if high - low > tol:
+            return False
+    return True
+
+@njit(inline='always')
+def record_state(t, mcs, species_counts, rec_t, rec_mcs, rec_populations, n_records):
+    """
+    Append the time, Monte Carlo steps and populations to the recording buffers
+
+    Returns:
+    - Updated number of records
+    """
+    rec_t[n_records] = t
+    rec_mcs[n_records] = mcs
+    for k in range(rec_populations.shape[0]):
+        rec_populations[k, n_records] = species_counts[k+1]
+    return n_records + 1
+
+@njit(nogil=True)
+def run_events(sites, neighbours, pair_class, pair_members, pair_position, class_counts, species_counts,
+               n_events, max_mcs, max_time, t, mcs, event, sigma, mu, epsilon, D,
+               every, every_mcs, next_mcs, rec_t, rec_mcs, rec_populations, n_records,
+               stop_extinction=False, converge_window=0, converge_tol=0.0):
+    """
+    Run up to n_events Gillespie steps in a single compiled loop, recording
+    time, Monte Carlo steps and species counts into preallocated buffers.
+
+    Parameters:
+    - sites, neighbours and bookkeeping structures: Flat lattice, neighbour table and
+      bookkeeping from init_pair_state, updated in place
+    - n_events: Maximum number of events to perform
+    - max_mcs: Stop once the Monte Carlo time reaches this value
+    - max_time: Stop once the time reaches this value
+    - t, mcs, event: Current time, Monte Carlo steps and total number of events
+    - sigma, mu, epsilon, D: Reaction rates
+    - every, every_mcs, next_mcs: Recording cadence (see TrajectoryRecorder)
+    - rec_t, rec_mcs, rec_populations: Recording buffers
+    - n_records: Number of records already in the buffers
+    - stop_extinction: Stop as soon as a species has no individual left
+    - converge_window, converge_tol: If converge_window > 0, stop when the fractions
+      stayed within converge_tol over the last converge_window records, checked
+      every converge_window records
+
+    The state where the run stops at an absorbing state or an extinction is
+    always recorded, even between two records of the cadence.
+
+    Returns:
+    - Updated t, mcs, event, n_records and next_mcs
+    - Reason to stop (STOP_BUDGET, STOP_BUFFER_FULL, STOP_ABSORBING, STOP_EXTINCTION
+      or STOP_CONVERGED)
+    """
+    capacity = rec_t.shape[0]
+    for _ in range(n_events):
+        if mcs >= max_mcs or t >= max_time:
+            return t, mcs, event, n_records, next_mcs, STOP_BUDGET
+        if n_records >= capacity:
+            return t, mcs, event, n_records, next_mcs, STOP_BUFFER_FULL
+
+        tau, dmcs = gillespie_lattice_step(sites, neighbours, pair_class, pair_members, pair_position,
+                                           class_counts, species_counts, sigma, mu, epsilon, D)
+        if tau == 0:
+            if n_records == 0 or rec_t[n_records-1] != t:
+                n_records = record_state(t, mcs, species_counts, rec_t, rec_mcs, rec_populations, n_records)
+            return t, mcs, event, n_records, next_mcs, STOP_ABSORBING
+        t += tau
+        mcs += dmcs
+        event += 1
+
+        if every_mcs > 0:
+            due = mcs >= next_mcs
+        else:
+            due = event % every == 0
+        if due:
+            n_records = record_state(t, mcs, species_counts, rec_t, rec_mcs, rec_populations, n_records)
+            if every_mcs > 0:
+                while next_mcs <= mcs:
+                    next_mcs += every_mcs
+            if converge_window > 0 and n_records % converge_window == 0 and \
+                    window_converged(rec_populations, n_records, converge_window, converge_tol):
+                return t, mcs, event, n_records, next_mcs, STOP_CONVERGED
+
+        if stop_extinction:
+            for k in range(1, species_counts.shape[0]):
+                if species_counts[k] == 0:
+                    if not due:
+                        n_records = record_state(t, mcs, species_counts, rec_t, rec_mcs, rec_populations, n_records)
+                    return t, mcs, event, n_records, next_mcs, STOP_EXTINCTION
+
+    return t, mcs, event, n_records, next_mcs, STOP_BUDGET
+
+class GillespieLattice:
+    """
+    Lattice Gillespie simulation: lattice, bookkeeping structures, clocks and rates.
+    Events are performed by run, which only returns to Python when the
+    requested number of events is done or the recording buffers must grow.
+    """
+    def __init__(self, space, sigma=1.0, mu=1.0, epsilon=5.0, D=5.0, neighbours=None):
+        self.space = np.ascontiguousarray(space, dtype=LATTICE_DTYPE)
+        self.sites = self.space.reshape(-1)
+        self.neighbours = neighbour_table(self.space.shape[0]) if neighbours is None else neighbours
+        self.sigma, self.mu, self.epsilon, self.D = sigma, mu, epsilon, D
+        (self.pair_class, self.pair_members, self.pair_position,
+         self.class_counts, self.species_counts) = init_pair_state(self.sites, self.neighbours)
+        self.t = 0.0
+        self.mcs = 0.0
+        self.events = 0
+
+    @property
+    def populations(self):
+        return self.species_counts[1:]
+
+    def state(self):
+        """
+        Everything the rest of the run depends on, to be saved in a
+        checkpoint: lattice, pair sets (their order decides which pair is
+        drawn), clocks and state of the generator of the compiled code
+        """
+        from rng_utils import get_numba_state
+        rng_index, rng_key = get_numba_state()
+        return dict(space=self.space, pair_class=self.pair_class, pair_members=self.pair_members,
+                    pair_position=self.pair_position, class_counts=self.class_counts,
+                    species_counts=self.species_counts, t=self.t, mcs=self.mcs, events=self.events,
+                    rng_index=rng_index, rng_key=rng_key)
+
+    def restore(self, state):
+        """
+        Continue from a state returned by state(), on a lattice of the same size
+        """
+        from rng_utils import set_numba_state
+        self.space[...] = state['space']
+        for name in ('pair_class', 'pair_members', 'pair_position', 'class_counts', 'species_counts'):
+            getattr(self, name)[...] = state[name]
+        self.t, self.mcs, self.events = state['t'], state['mcs'], state['events']
+        set_numba_state(state['rng_index'], state['rng_key'])
+
+    def run(self, n_events, recorder, max_mcs=np.inf, max_time=np.inf, stop_extinction=False, converge_window=0, converge_tol=0.0):
+        """
+        Perform up to n_events events, or until the Monte Carlo time reaches
+        max_mcs or the time reaches max_time, or one of the stopping criteria
+        of run_events is met
+
+        Returns:
+        - Reason to stop (STOP_BUDGET, STOP_ABSORBING, STOP_EXTINCTION or STOP_CONVERGED)
+        """
+        remaining = n_events
+        while True:
+            recorder.reserve(1)
+            rec_t, rec_mcs, rec_populations = recorder.buffers()
+            start = self.events
+            (self.t, self.mcs, self.events, recorder.size,
+             recorder.next_mcs, status) = run_events(
+                self.sites, self.neighbours, self.pair_class, self.pair_members, self.pair_position,
+                self.class_counts, self.species_counts,
+                remaining, max_mcs, max_time, self.t, self.mcs, self.events,
+                self.sigma, self.mu, self.epsilon, self.D,
+                recorder.every, recorder.every_mcs, recorder.next_mcs,
+                rec_t, rec_mcs, rec_populations, recorder.size,
+                stop_extinction, converge_window, converge_tol)
+            remaining -= self.events - start
+            if status != STOP_BUFFER_FULL:
+                return status
+            # Double the buffers and carry on
+            recorder.reserve(recorder.capacity)
+
+def run_parameters(size, initial_density, sigma, mu, epsilon, D, record_every, record_mcs, mode, tile):
+    """
+    Parameters of run_simulation that a restarted run must share with its checkpoint
+    """
+    return dict(size=size, initial_density=initial_density, sigma=sigma, mu=mu, epsilon=epsilon, D=D,
+                record_every=record_every, record_mcs=record_mcs, mode=mode, tile=tile)
+
+def run_simulation(size=100, initial_density=0.5, total_steps=1000, sigma=1.0, mu=1.0, epsilon=5.0, D=5.0, record_every=1, record_mcs=0.0, max_mcs=np.inf, mode='gillespie', tile=8, seed=None,
+                   snapshot_every=None, callback=None, progress=False, checkpoint=None, checkpoint_every=None, restart=None,
+                   stop_extinction=False, converge_window=0, converge_tol=0.0, exact_occupancy=False):
+    """
+    Run full lattice Gillespie simulation
+    
+    The simulation stops after total_steps events or once the Monte Carlo time
+    reaches max_mcs. The trajectory is recorded every record_every events, or
+    every record_mcs Monte Carlo steps when record_mcs is positive.
+    
+    The initial lattice has each site occupied with probability
+    initial_density, or exactly that fraction of the sites occupied with
+    exact_occupancy set.
+    
+    With mode = 'sublattice' the lattice is updated by parallel Monte Carlo
+    sweeps over tiles of side tile (see montecarlo_utils) and total_steps
+    counts sweeps instead of events. The Monte Carlo time (the sum of the
+    time steps divided by the number of individuals) has the same unit in
+    both modes.
+    
+    It also stops early at the first extinction of a species if
+    stop_extinction is set, and once the fractions stayed within
+    converge_tol over the last converge_window records if converge_window
+    is positive (checked every converge_window records).
+    
+    callback(lattice, recorder) is called with the initial lattice, then
+    every snapshot_every events and when the run stops early (absorbing
+    state or stopping criterion), e.g. to draw or store the lattice.
+    
+    With checkpoint set, the lattice, clocks, random state and records are
+    saved to that file every checkpoint_every events and at the end.
+    restart resumes the run stored in a checkpoint file (the initial
+    callback is then skipped); it continues exactly as the interrupted run
+    would have, and the run can be extended by a larger total_steps.
+    
+    Returns:
+    - Final lattice
+    - TrajectoryRecorder with the times, Monte Carlo steps and populations
+    - Reason the run stopped: STOP_BUDGET (total_steps or max_mcs reached),
+      STOP_ABSORBING, STOP_EXTINCTION or STOP_CONVERGED
+    """
+    # Imported here, montecarlo_utils imports this module
+    from montecarlo_utils import SublatticeLattice
+    from recording import TrajectoryRecorder
+    from rng_utils import seed_numba
+    from storage import save_checkpoint, load_checkpoint
+
+    parameters = run_parameters(size, initial_density, sigma, mu, epsilon, D, record_every, record_mcs, mode, tile)
+    if seed is not None:
+        np.random.seed(seed)
+        seed_numba(seed)
+    
+    if restart is not None:
+        state, _ = load_checkpoint(restart, parameters)
+        space = state['lattice']['space']
+    else:
+        # Initialize space with species A, B, C (1, 2, 3)
+        space = random_lattice(size, initial_density, exact=exact_occupancy)
+    
+    if mode == 'sublattice':
+        lattice = SublatticeLattice(space, sigma, mu, epsilon, D, tile=tile,
+                                    seed=seed if seed is not None else np.random.randint(2**31))
+    else:
+        # Lattice with its pair classes and species counts, updated locally by every reaction
+        lattice = GillespieLattice(space, sigma, mu, epsilon, D)
+    
+    # Time, Monte Carlo steps and populations, recorded with the requested cadence
+    recorder = TrajectoryRecorder(capacity=min(total_steps//record_every + 2, 1 << 20),
+                                  every=record_every, every_mcs=record_mcs)
+    if restart is not None:
+        lattice.restore(state['lattice'])
+        recorder.restore(state['recorder'])
+    else:
+        recorder.record(lattice.t, lattice.mcs, lattice.populations)
+    
+    def save():
+        save_checkpoint(checkpoint, dict(lattice=lattice.state(), recorder=recorder.state()),
+                        dict(parameters, seed=seed, events=lattice.events))
+    
+    # Run simulation, returning from the compiled loop only for the snapshots and checkpoints
+    if callback is None or snapshot_every is None:
+        snapshot_every = max(total_steps, 1)
+    elif restart is None:
+        callback(lattice, recorder)
+    if checkpoint is None or checkpoint_every is None:
+        checkpoint_every = max(total_steps, 1)
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(total=total_steps, initial=lattice.events)
+    
+    status = STOP_BUDGET
+    while lattice.events < total_steps and lattice.mcs < max_mcs and status == STOP_BUDGET:
+        start = lattice.events
+        stop = min((start // snapshot_every + 1) * snapshot_every,
+                   (start // checkpoint_every + 1) * checkpoint_every, total_steps)
+        status = lattice.run(stop - start, recorder, max_mcs, stop_extinction=stop_extinction,
+                             converge_window=converge_window, converge_tol=converge_tol)
+        if progress:
+            bar.update(lattice.events - start)
+        
+        if callback is not None and (lattice.events % snapshot_every == 0 or status != STOP_BUDGET):
+            callback(lattice, recorder)
+        if checkpoint is not None and lattice.events % checkpoint_every == 0:
+            save()
+    
+    if checkpoint is not None and lattice.events % checkpoint_every != 0:
+        save()
+    if progress:
+        bar.close()
+    
+    return lattice.space, recorder, status
@@ -0,0 +1,90 @@
+"""
+    Lattice representation shared by the rock-paper-scissors engines.
+
+    The lattice is an L x L array of LATTICE_DTYPE (0 for empty sites, 1, 2, 3
+    for the species) and the engines work on its flat view, with site
+    i = x*L + y. The periodic wrap of the coordinates is precomputed once in
+    a table of L + 2 entries, so no modulo arithmetic is done per visit and
+    the neighbours cost no memory per site: the lattice takes 1 byte per site.
+
+    place_individuals fills a lattice with an exact number of individuals,
+    for the initial lattices of the rock-paper-scissors engines and the
+    yearly cohorts of the lizard model.
+"""
+
+import numpy as np
+from numba import njit
+
+from rng_utils import next_int, next_double
+
+LATTICE_DTYPE = np.int8
+
+# Moore neighbourhood, the opposite direction of DX[d], DY[d] is stored in OPPOSITE[d]
+DX = np.array([0, 1, 0, -1, 1, 1, -1, -1])
+DY = np.array([1, 0, -1, 0, 1, -1, 1, -1])
+OPPOSITE = np.array([2, 3, 0, 1, 7, 6, 5, 4])
+
+@njit
+def neighbour_table(size):
+    """
+    Periodic wrap of the coordinates of an L x L lattice, read by neighbour
+
+    Returns:
+    - Array of L + 2 entries, entry x + 1 holding x mod L for x = -1 ... L
+    """
+    wrap = np.empty(size + 2, dtype=np.int64)
+    for x in range(-1, size + 1):
+        wrap[x + 1] = x % size
+    return wrap
+
+@njit(inline='always')
+def neighbour(neighbours, i, d):
+    """
+    Flat index of the neighbour of site i in direction d (DX[d], DY[d]),
+    neighbours being the table of neighbour_table
+    """
+    size = neighbours.shape[0] - 2
+    x = i // size
+    y = i - x*size
+    return neighbours[x + 1 + DX[d]]*size + neighbours[y + 1 + DY[d]]
+
+@njit
+def sample_sites(order, k, states, stream):
+    """
+    Move a uniformly random ordered selection of k entries of order to its
+    first k slots (partial Fisher-Yates shuffle), in O(k). order may be any
+    permutation, e.g. the one left by a previous call, so it is built once.
+    """
+    n = len(order)
+    for i in range(k):
+        j = i + next_int(states, stream, n - i)
+        order[i], order[j] = order[j], order[i]
+
+@njit
+def place_individuals(sites, order, types, counts, states, stream, mutation=0.0):
+    """
+    Place len(types) individuals on distinct random sites, in O(len(types))
+
+    Each individual becomes, with probability mutation, one of the other
+    types drawn uniformly (the types being 1 to len(counts) - 1).
+
+    Parameters:
+    - sites: Flat lattice, updated in place
+    - order: Flat indices of the empty sites in any order (e.g. np.arange(L*L) for an
+      empty lattice), reordered in place
+    - types: Type of each individual
+    - counts: Number of sites of each type (counts[0]: empty sites), updated in place
+    - states, stream: Random streams and index of the one to draw from (see rng_utils)
+    """
+    k = len(types)
+    if k > len(order):
+        raise ValueError("More individuals than empty sites")
+    n_types = len(counts) - 1
+    sample_sites(order, k, states, stream)
+    for i in range(k):
+        new_type = types[i]
+        if mutation > 0 and next_double(states, stream) < mutation:
+            new_type = 1 + (new_type + next_int(states, stream, n_types - 1)) % n_types
+        sites[order[i]] = new_type
+        counts[new_type] += 1
+        counts[0] -= 1
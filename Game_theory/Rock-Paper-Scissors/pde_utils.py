@@ -0,0 +1,803 @@
+"""
+    Reaction-diffusion equations of the rock-paper-scissors model with
+    mutations and nonlinear mobility, integrated on a periodic L x L grid.
+
+    For each species i (indices taken modulo 3) and r = s1 + s2 + s3:
+
+        ds_i/dt = s_i [beta (1 - r) - sigma s_{i-1}] + zeta s_i (s_{i+1} - s_{i-1})
+                  + mu (s_{i-1} + s_{i+1} - 2 s_i)
+                  + (deltaE - deltaD) (r lap(s_i) - s_i lap(r)) + deltaD lap(s_i)
+
+    The integration runs in euler_kernel, a compiled stencil that computes
+    the three right-hand sides and the clipped Euler update in a single pass
+    over the grid, writing into a preallocated buffer (no temporaries, no
+    np.roll copies). laplacian, pde_rhs and euler_step are the NumPy
+    reference implementation of the same step.
+
+    With method = 'etd2' the equations are instead integrated by the
+    second-order exponential time differencing Runge-Kutta scheme (ETDRK2,
+    Cox & Matthews 2002) on the periodic grid: the linear diffusion
+    deltaD lap(s_i) is integrated exactly in Fourier space, using the symbol
+    of the same five-point Laplacian, and the reactions and nonlinear
+    mobility (rhs_kernel) explicitly. The step is then no longer
+    limited by the diffusive stability bound dt < dx^2/(4 deltaD).
+
+    With method = 'rk23' each interval dt is covered by adaptive steps of the
+    embedded Bogacki-Shampine 3(2) pair (RK23Integrator): the local error of
+    the three fields is estimated from the embedded second-order solution
+    and the step size adjusted to keep it within rtol and atol. Steps are
+    cut to end exactly on the output times, so dt only sets the output
+    cadence.
+
+    For the Euler method the grid can also be cut into horizontal strips
+    (StripDecomposition), each stored with one halo row above and below and
+    advanced by its own task on a thread pool (the kernels release the GIL).
+    Before every step each strip copies the boundary rows of its neighbours
+    into its halos. The cells are computed by the same code and the row
+    sums reduced in the same order as in euler_kernel, so the results are
+    bit-identical to the single-domain run.
+
+    run_ensemble advances E independent realisations, stored along a leading
+    axis of shape (E, 3, L, L), with the same Euler kernel parallelised over
+    members and rows. beta, sigma, zeta and mu may differ between members.
+    Every member follows exactly the trajectory of a single run_pde run.
+
+    Reference:
+    - Bogacki, P. & Shampine, L. F. (1989). A 3(2) pair of Runge-Kutta formulas. Applied Mathematics Letters. 2, 321-325.
+    - Cox, S. M. & Matthews, P. C. (2002). Exponential time differencing for stiff systems. Journal of Computational Physics. 176, 430-455.
+    - Szczesny, B., Mobilia, M. & Rucklidge, A. M. (2014). Characterization of spiraling patterns in spatial rock-paper-scissors games. Physical Review E. 90, 032704.
+"""
+
+import numpy as np
+from numba import njit, prange
+from concurrent.futures import ThreadPoolExecutor
+
+from gillespie_utils import STOP_BUDGET, STOP_EXTINCTION, STOP_CONVERGED
+from recording import DensityRecorder
+
+# Helper functions for Laplacian with periodic boundaries
+def laplacian(Z, dx=1.0):
+    return (
+        np.roll(Z, 1, axis=0) + np.roll(Z, -1, axis=0) +
+        np.roll(Z, 1, axis=1) + np.roll(Z, -1, axis=1) -
+        4 * Z
+    ) / dx**2
+
+def initial_densities(L=128, beta=1.0, sigma=1.0, dtype=np.float64):
+    """
+    Small random perturbations around the coexistence fixed point
+
+    The random numbers are drawn in float64 whatever the dtype, so runs in
+    different precisions start from the same state.
+
+    Returns:
+    - s1, s2, s3: Density fields of shape (L, L)
+    """
+    s1 = beta / (3 * beta + sigma) + 0.01 * np.random.rand(L, L)
+    s2 = beta / (3 * beta + sigma) + 0.01 * np.random.rand(L, L)
+    s3 = beta / (3 * beta + sigma) + 0.01 * np.random.rand(L, L)
+    return s1.astype(dtype), s2.astype(dtype), s3.astype(dtype)
+
+def pde_rhs(s1, s2, s3, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+    """
+    Time derivatives of the three densities
+
+    Returns:
+    - ds1_dt, ds2_dt, ds3_dt: Right-hand sides of the equations
+    - r: Total density
+    """
+    # Total density
+    r = s1 + s2 + s3
+
+    # Compute Laplacians
+    lap_s1 = laplacian(s1, dx)
+    lap_s2 = laplacian(s2, dx)
+    lap_s3 = laplacian(s3, dx)
+    lap_r = laplacian(r, dx)
+
+    # Update equations
+    ds1_dt = (
+        s1 * (beta * (1 - r) - sigma * s3) +
+        zeta * s1 * (s2 - s3) +
+        mu * (s3 + s2 - 2 * s1) +
+        (deltaE - deltaD) * (r * lap_s1 - s1 * lap_r) +
+        deltaD * lap_s1
+    )
+    ds2_dt = (
+        s2 * (beta * (1 - r) - sigma * s1) +
+        zeta * s2 * (s3 - s1) +
+        mu * (s1 + s3 - 2 * s2) +
+        (deltaE - deltaD) * (r * lap_s2 - s2 * lap_r) +
+        deltaD * lap_s2
+    )
+    ds3_dt = (
+        s3 * (beta * (1 - r) - sigma * s2) +
+        zeta * s3 * (s1 - s2) +
+        mu * (s2 + s1 - 2 * s3) +
+        (deltaE - deltaD) * (r * lap_s3 - s3 * lap_r) +
+        deltaD * lap_s3
+    )
+    return ds1_dt, ds2_dt, ds3_dt, r
+
+def euler_step(s1, s2, s3, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+    """
+    One explicit Euler step, the densities are clipped to [0, 1]
+
+    Returns:
+    - s1, s2, s3: Updated densities
+    - r: Total density before the step
+    """
+    ds1_dt, ds2_dt, ds3_dt, r = pde_rhs(s1, s2, s3, beta, sigma, zeta, mu, deltaD, deltaE, dx)
+
+    # Euler update
+    s1 = s1 + dt * ds1_dt
+    s2 = s2 + dt * ds2_dt
+    s3 = s3 + dt * ds3_dt
+
+    # Ensure densities remain non-negative
+    s1 = np.clip(s1, 0, 1)
+    s2 = np.clip(s2, 0, 1)
+    s3 = np.clip(s3, 0, 1)
+    return s1, s2, s3, r
+
+@njit(inline='always')
+def site_rhs(s, x, y, xm, xp, ym, yp, idx2, coefficients):
+    """
+    Densities, total density and right-hand sides at site (x, y), whose
+    neighbouring rows and columns are xm, xp, ym, yp
+
+    coefficients holds beta, sigma, zeta, mu, deltaE - deltaD and the
+    coefficient of the linear diffusion, already in the precision of s,
+    so that float32 fields are updated in float32 arithmetic.
+    """
+    T = s.dtype.type
+    beta, sigma, zeta, mu, cross, diffusion = coefficients
+    a = s[0, x, y]
+    b = s[1, x, y]
+    c = s[2, x, y]
+    r = a + b + c
+
+    lap_a = (s[0, xm, y] + s[0, xp, y] + s[0, x, ym] + s[0, x, yp] - T(4) * a) * idx2
+    lap_b = (s[1, xm, y] + s[1, xp, y] + s[1, x, ym] + s[1, x, yp] - T(4) * b) * idx2
+    lap_c = (s[2, xm, y] + s[2, xp, y] + s[2, x, ym] + s[2, x, yp] - T(4) * c) * idx2
+    lap_r = lap_a + lap_b + lap_c
+    growth = beta * (T(1) - r)
+
+    da = (a * (growth - sigma * c) + zeta * a * (b - c) + mu * (c + b - T(2) * a) +
+          cross * (r * lap_a - a * lap_r) + diffusion * lap_a)
+    db = (b * (growth - sigma * a) + zeta * b * (c - a) + mu * (a + c - T(2) * b) +
+          cross * (r * lap_b - b * lap_r) + diffusion * lap_b)
+    dc = (c * (growth - sigma * b) + zeta * c * (a - b) + mu * (b + a - T(2) * c) +
+          cross * (r * lap_c - c * lap_r) + diffusion * lap_c)
+    return a, b, c, r, da, db, dc
+
+@njit(inline='always')
+def euler_row(s, out, x, xm, xp, row, row_sums, idx2, coefficients, step):
+    """
+    Clipped Euler update of row x of s, whose neighbouring rows are xm and
+    xp, written into the same row of out. The sums of the row (total density
+    before the step and the three updated densities) go to column row of
+    row_sums.
+    """
+    T = s.dtype.type
+    zero = T(0)
+    one = T(1)
+    n = s.shape[2]
+    sum_r = 0.0
+    sum_1 = 0.0
+    sum_2 = 0.0
+    sum_3 = 0.0
+    for y in range(n):
+        ym = y - 1 if y > 0 else n - 1
+        yp = y + 1 if y < n - 1 else 0
+        a, b, c, r, da, db, dc = site_rhs(s, x, y, xm, xp, ym, yp, idx2, coefficients)
+
+        # Euler update, densities kept in [0, 1]
+        a = min(max(a + step * da, zero), one)
+        b = min(max(b + step * db, zero), one)
+        c = min(max(c + step * dc, zero), one)
+        out[0, x, y] = a
+        out[1, x, y] = b
+        out[2, x, y] = c
+
+        sum_r += r
+        sum_1 += a
+        sum_2 += b
+        sum_3 += c
+    row_sums[0, row] = sum_r
+    row_sums[1, row] = sum_1
+    row_sums[2, row] = sum_2
+    row_sums[3, row] = sum_3
+
+@njit(nogil=True)
+def reduce_row_sums(row_sums):
+    """
+    Totals of the row sums, added in row order
+    """
+    sum_r = 0.0
+    sum_1 = 0.0
+    sum_2 = 0.0
+    sum_3 = 0.0
+    for x in range(row_sums.shape[1]):
+        sum_r += row_sums[0, x]
+        sum_1 += row_sums[1, x]
+        sum_2 += row_sums[2, x]
+        sum_3 += row_sums[3, x]
+    return sum_r, sum_1, sum_2, sum_3
+
+@njit(parallel=True, nogil=True)
+def euler_kernel(s, out, row_sums, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+    """
+    One clipped Euler step of the densities s, of shape (3, L, L), written into out
+
+    Rows are updated in parallel. row_sums, of shape (4, L), receives the
+    sums of each row of the total density before the step and of the three
+    updated densities, which are reduced serially so the totals do not
+    depend on the number of threads. The update is done in the precision of
+    s, the sums are accumulated in float64.
+
+    Returns:
+    - Sum of the total density before the step
+    - Sums of the three updated densities
+    """
+    T = s.dtype.type
+    L = s.shape[1]
+    idx2 = T(1.0 / (dx * dx))
+    coefficients = (T(beta), T(sigma), T(zeta), T(mu), T(deltaE - deltaD), T(deltaD))
+    step = T(dt)
+    for x in prange(L):
+        xm = x - 1 if x > 0 else L - 1
+        xp = x + 1 if x < L - 1 else 0
+        euler_row(s, out, x, xm, xp, x, row_sums, idx2, coefficients, step)
+    return reduce_row_sums(row_sums)
+
+@njit(nogil=True)
+def strip_euler_kernel(s, out, row_sums, first_row, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+    """
+    Clipped Euler step of a strip of rows, of shape (3, n + 2, L) with one halo row on each side
+
+    The n interior rows are written into out and their sums into columns
+    first_row to first_row + n - 1 of row_sums. The halo rows must hold the
+    neighbouring rows of the grid.
+    """
+    T = s.dtype.type
+    n = s.shape[1] - 2
+    idx2 = T(1.0 / (dx * dx))
+    coefficients = (T(beta), T(sigma), T(zeta), T(mu), T(deltaE - deltaD), T(deltaD))
+    step = T(dt)
+    for x in range(1, n + 1):
+        euler_row(s, out, x, x - 1, x + 1, first_row + x - 1, row_sums, idx2, coefficients, step)
+
+@njit(parallel=True, nogil=True)
+def ensemble_euler_kernel(s, out, row_sums, totals, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+    """
+    One clipped Euler step of an ensemble of densities s, of shape (E, 3, L, L), written into out
+
+    beta, sigma, zeta and mu are arrays with the parameters of each member.
+    The rows of all members are updated in parallel, row_sums has shape
+    (E, 4, L) and totals, of shape (E, 4), receives for each member the sum
+    of the total density before the step and the sums of the three updated
+    densities.
+    """
+    T = s.dtype.type
+    E = s.shape[0]
+    L = s.shape[2]
+    idx2 = T(1.0 / (dx * dx))
+    step = T(dt)
+    for k in prange(E * L):
+        e = k // L
+        x = k % L
+        xm = x - 1 if x > 0 else L - 1
+        xp = x + 1 if x < L - 1 else 0
+        coefficients = (T(beta[e]), T(sigma[e]), T(zeta[e]), T(mu[e]), T(deltaE - deltaD), T(deltaD))
+        euler_row(s[e], out[e], x, xm, xp, x, row_sums[e], idx2, coefficients, step)
+    for e in range(E):
+        sum_r, sum_1, sum_2, sum_3 = reduce_row_sums(row_sums[e])
+        totals[e, 0] = sum_r
+        totals[e, 1] = sum_1
+        totals[e, 2] = sum_2
+        totals[e, 3] = sum_3
+
+@njit(parallel=True, nogil=True)
+def rhs_kernel(s, out, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0, linear=True):
+    """
+    Right-hand sides of the equations for the densities s, of shape (3, L, L), written into out
+
+    With linear = False the linear diffusion deltaD lap(s_i) is left out,
+    leaving the reactions and nonlinear mobility (explicit part of ETDRK2).
+    """
+    T = s.dtype.type
+    L = s.shape[1]
+    idx2 = T(1.0 / (dx * dx))
+    coefficients = (T(beta), T(sigma), T(zeta), T(mu), T(deltaE - deltaD), T(deltaD if linear else 0.0))
+    for x in prange(L):
+        xm = x - 1 if x > 0 else L - 1
+        xp = x + 1 if x < L - 1 else 0
+        for y in range(L):
+            ym = y - 1 if y > 0 else L - 1
+            yp = y + 1 if y < L - 1 else 0
+            a, b, c, r, da, db, dc = site_rhs(s, x, y, xm, xp, ym, yp, idx2, coefficients)
+            out[0, x, y] = da
+            out[1, x, y] = db
+            out[2, x, y] = dc
+
+def laplacian_symbol(L, dx=1.0):
+    """
+    Eigenvalues -k^2 of the periodic five-point Laplacian on the rfft2 grid
+
+    Returns:
+    - Array of shape (L, L//2 + 1)
+    """
+    kx = 2 * np.pi * np.fft.fftfreq(L)
+    ky = 2 * np.pi * np.fft.rfftfreq(L)
+    return -4 / dx**2 * (np.sin(kx / 2)[:, None]**2 + np.sin(ky / 2)[None, :]**2)
+
+def etd_coefficients(L, dt, deltaD, dx=1.0, dtype=np.float64):
+    """
+    Coefficients of the ETDRK2 step for the linear operator deltaD lap
+
+    With c the eigenvalues of the operator and z = c dt:
+    - E = exp(z)
+    - phi1 = (exp(z) - 1)/c
+    - phi2 = (exp(z) - 1 - z)/(c^2 dt)
+    phi1 and phi2 are evaluated by their Taylor series near z = 0, where
+    the closed forms lose all precision (the k = 0 mode, small deltaD).
+    They are computed in float64 and returned in the precision of dtype.
+    """
+    z = deltaD * laplacian_symbol(L, dx) * dt
+    small = np.abs(z) < 1e-4
+    zs = np.where(small, 1.0, z)
+    E = np.exp(z)
+    phi1 = dt * np.where(small, 1 + z/2 + z**2/6, np.expm1(zs) / zs)
+    phi2 = dt * np.where(small, 1/2 + z/6 + z**2/24, (np.expm1(zs) - zs) / zs**2)
+    return E.astype(dtype), phi1.astype(dtype), phi2.astype(dtype)
+
+def etd2_step(s, nonlinear, E, phi1, phi2, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+    """
+    One ETDRK2 step of the densities s, of shape (3, L, L), clipped to [0, 1]
+
+    nonlinear is a buffer of the shape of s for the explicit terms.
+
+    Returns:
+    - Updated densities
+    """
+    L = s.shape[1]
+    rhs_kernel(s, nonlinear, beta, sigma, zeta, mu, deltaD, deltaE, dx, False)
+    s_hat = np.fft.rfft2(s)
+    n_hat = np.fft.rfft2(nonlinear)
+
+    # Exponential Euler predictor
+    a_hat = E * s_hat + phi1 * n_hat
+    a = np.fft.irfft2(a_hat, s=(L, L))
+
+    # Second-order corrector
+    rhs_kernel(a, nonlinear, beta, sigma, zeta, mu, deltaD, deltaE, dx, False)
+    a_hat += phi2 * (np.fft.rfft2(nonlinear) - n_hat)
+    s_next = np.fft.irfft2(a_hat, s=(L, L))
+
+    # Ensure densities remain non-negative
+    np.clip(s_next, 0, 1, out=s_next)
+    return s_next
+
+class RK23Integrator:
+    """
+    Adaptive Bogacki-Shampine 3(2) integrator of the densities, of shape (3, L, L)
+
+    The error of a step is the RMS over all sites and species of
+    err/(atol + rtol*max(|s|, |s_new|)), the step is accepted when it is
+    at most 1. The last stage of an accepted step is the first of the next
+    (FSAL), unless clipping the densities to [0, 1] changed the state.
+
+    Attributes:
+    - h: Size of the next step
+    - accepted, rejected: Number of accepted and rejected steps
+    - evaluations: Number of right-hand side evaluations
+    """
+    safety = 0.9
+    min_factor = 0.2
+    max_factor = 5.0
+
+    def __init__(self, shape, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0, rtol=1e-3, atol=1e-6, h=None, dtype=np.float64):
+        self.params = (beta, sigma, zeta, mu, deltaD, deltaE, dx)
+        self.rtol, self.atol = rtol, atol
+        self.h = h
+        self.accepted = 0
+        self.rejected = 0
+        self.evaluations = 0
+        self._k1, self._k2, self._k3, self._k4 = (np.empty(shape, dtype=dtype) for _ in range(4))
+        self._stage = np.empty(shape, dtype=dtype)
+        self._error = np.empty(shape, dtype=dtype)
+        self._k1_valid = False
+
+    def state(self):
+        """
+        Step size, counters and first stage, to be saved in a checkpoint
+        """
+        return dict(h=np.nan if self.h is None else self.h, accepted=self.accepted, rejected=self.rejected,
+                    evaluations=self.evaluations, k1=self._k1, k1_valid=self._k1_valid)
+
+    def restore(self, state):
+        """
+        Continue from a state returned by state()
+        """
+        self.h = None if np.isnan(state['h']) else state['h']
+        self.accepted, self.rejected, self.evaluations = state['accepted'], state['rejected'], state['evaluations']
+        self._k1[...] = state['k1']
+        self._k1_valid = state['k1_valid']
+
+    def _rhs(self, s, out):
+        rhs_kernel(s, out, *self.params)
+        self.evaluations += 1
+
+    def advance(self, s, span):
+        """
+        Advance the densities s in place by span units of time
+        """
+        if self.h is None:
+            self.h = span
+        if not self._k1_valid:
+            self._rhs(s, self._k1)
+            self._k1_valid = True
+
+        t = 0.0
+        while t < span:
+            h = min(self.h, span - t)
+            if h < 1e-12 * span:
+                raise RuntimeError(f"Step size {h:.3e} too small, the integration does not converge")
+            k1, k2, k3, k4, y = self._k1, self._k2, self._k3, self._k4, self._stage
+
+            np.multiply(k1, h / 2, out=y)
+            y += s
+            self._rhs(y, k2)
+            np.multiply(k2, 3 * h / 4, out=y)
+            y += s
+            self._rhs(y, k3)
+            # Third-order solution, its derivative is the first stage of the next step
+            np.multiply(k1, 2 * h / 9, out=y)
+            y += s
+            y += (h / 3) * k2
+            y += (4 * h / 9) * k3
+            self._rhs(y, k4)
+
+            # Difference with the embedded second-order solution
+            err = self._error
+            np.multiply(k1, -5 * h / 72, out=err)
+            err += (h / 12) * k2
+            err += (h / 9) * k3
+            err -= (h / 8) * k4
+            scale = self.atol + self.rtol * np.maximum(np.abs(s), np.abs(y))
+            norm = np.sqrt(np.mean((err / scale)**2))
+
+            if norm <= 1:
+                t = span if h == span - t else t + h
+                self.accepted += 1
+                s[...] = y
+                self._k1, self._k4 = k4, k1
+                # Ensure densities remain non-negative
+                if s.min() < 0 or s.max() > 1:
+                    np.clip(s, 0, 1, out=s)
+                    self._rhs(s, self._k1)
+                factor = self.max_factor if norm == 0 else min(self.max_factor, self.safety * norm**(-1/3))
+                # A step shortened to hit the output time says little about the step size
+                self.h = max(self.h, h * factor) if h < self.h else h * factor
+            else:
+                self.rejected += 1
+                factor = self.min_factor if not np.isfinite(norm) else max(self.min_factor, self.safety * norm**(-1/3))
+                self.h = h * min(factor, 1.0)
+        return s
+
+class StripDecomposition:
+    """
+    Densities of shape (3, L, L) cut into strips of rows advanced in parallel by Euler steps
+
+    Parameters:
+    - s: Initial densities, copied into the strips
+    - n_strips: Number of strips (at most L)
+    - workers: Number of threads (default: n_strips)
+    """
+    def __init__(self, s, n_strips, workers=None):
+        L = s.shape[1]
+        if not 1 <= n_strips <= L:
+            raise ValueError(f"The number of strips must be between 1 and the grid size {L}, got {n_strips}")
+        self.shape = s.shape
+        self.bounds = np.linspace(0, L, n_strips + 1).astype(int)
+        self._current = []
+        self._next = []
+        for x0, x1 in zip(self.bounds[:-1], self.bounds[1:]):
+            strip = np.empty((3, x1 - x0 + 2, s.shape[2]), dtype=s.dtype)
+            strip[:, 1:-1] = s[:, x0:x1]
+            self._current.append(strip)
+            self._next.append(np.empty_like(strip))
+        self._row_sums = np.empty((4, L))
+        self._pool = ThreadPoolExecutor(max_workers=workers if workers is not None else n_strips)
+
+    def _exchange_halos(self, k):
+        # Only the interior rows of the neighbours are read, which no other task writes
+        strips = self._current
+        strips[k][:, 0] = strips[k - 1][:, -2]
+        strips[k][:, -1] = strips[(k + 1) % len(strips)][:, 1]
+
+    def _advance_strip(self, k, *params):
+        self._exchange_halos(k)
+        strip_euler_kernel(self._current[k], self._next[k], self._row_sums, self.bounds[k], *params)
+
+    def step(self, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx=1.0):
+        """
+        One clipped Euler step of the whole grid
+
+        Returns:
+        - Sum of the total density before the step
+        - Sums of the three updated densities
+        """
+        params = (dt, beta, sigma, zeta, mu, deltaD, deltaE, dx)
+        futures = [self._pool.submit(self._advance_strip, k, *params) for k in range(len(self._current))]
+        for future in futures:
+            future.result()
+        self._current, self._next = self._next, self._current
+        return reduce_row_sums(self._row_sums)
+
+    def gather(self):
+        """
+        Densities of the whole grid, of shape (3, L, L)
+        """
+        return np.concatenate([strip[:, 1:-1] for strip in self._current], axis=1)
+
+    def close(self):
+        self._pool.shutdown()
+
+def run_parameters(L, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx, method, rtol, atol, dtype, record_every):
+    """
+    Parameters of run_pde that a restarted run must share with its checkpoint
+    """
+    return dict(L=L, dt=dt, beta=beta, sigma=sigma, zeta=zeta, mu=mu, deltaD=deltaD, deltaE=deltaE,
+                dx=dx, method=method, rtol=rtol, atol=atol, dtype=np.dtype(dtype).name, record_every=record_every)
+
+def run_pde(s1, s2, s3, n_steps, dt, beta=1.0, sigma=1.0, zeta=0.0, mu=0.0, deltaD=1.0, deltaE=1.0, dx=1.0,
+            snapshot_every=None, callback=None, progress=False, method='euler', rtol=1e-3, atol=1e-6, stats=None, dtype=None,
+            strips=None, workers=None, record_every=1, checkpoint=None, checkpoint_every=None, restart=None,
+            extinction_threshold=None, converge_window=0, converge_tol=0.0):
+    """
+    Integrate the equations for n_steps steps of size dt
+
+    The fraction of each species, its sum over the grid divided by the sum
+    of the total density before the step, is recorded every record_every
+    steps in a preallocated DensityRecorder. The Euler kernels return the
+    sums from their update pass; the other methods reduce the fields once
+    per recorded step, reusing the sums of the previous step when it was
+    recorded too.
+
+    Parameters:
+    - s1, s2, s3: Initial densities, of shape (L, L)
+    - dx: Grid spacing
+    - dtype: Precision of the integration, np.float64 or np.float32 (default: that of s1)
+    - method: 'euler' (fused explicit Euler kernel), 'etd2' (ETDRK2 pseudo-spectral scheme)
+      or 'rk23' (adaptive Runge-Kutta, dt is then only the interval between outputs)
+    - rtol, atol: (rk23) Relative and absolute tolerances of the local error
+    - stats: (rk23) Dictionary receiving the number of accepted and rejected steps and of
+      right-hand side evaluations
+    - snapshot_every: Steps between calls of callback (steps with t % snapshot_every == 0)
+    - callback: Called as callback(t, s1, s2, s3, recorder) after step t, i.e. with
+      the fields at time (t + 1)*dt, recorder being the DensityRecorder with the
+      fractions recorded so far
+    - progress: Whether to show a progress bar
+    - strips: (euler) Number of strips of the domain decomposition, advanced in parallel
+      by workers threads (default: one thread per strip), None for a single domain
+    - checkpoint: File where the fields, step, records and integrator state are saved
+      every checkpoint_every steps and at the end
+    - restart: Checkpoint file to resume from, s1, s2, s3 are then ignored. The run
+      continues exactly as the interrupted one would have, up to n_steps
+    - extinction_threshold: Stop once the fraction of a species falls below this value
+    - converge_window, converge_tol: If converge_window > 0, stop once the fractions
+      stayed within converge_tol (max - min) over the last converge_window records,
+      checked every converge_window records
+    The stopping criteria are evaluated on the recorded fractions, the
+    callback is also called at the step where the run stops.
+
+    Returns:
+    - s1, s2, s3: Final densities
+    - densities: Array of shape (3, n_steps//record_every), fraction of each species
+      after every record_every steps (fewer records if the run stopped early)
+    - Reason the run stopped: STOP_BUDGET (n_steps done), STOP_EXTINCTION or
+      STOP_CONVERGED (see gillespie_utils)
+    """
+    if method not in ('euler', 'etd2', 'rk23'):
+        raise ValueError(f"Unknown method '{method}', expected 'euler', 'etd2' or 'rk23'")
+
+    dtype = np.dtype(np.asarray(s1).dtype if dtype is None else dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f"Unsupported dtype {dtype}, expected float32 or float64")
+    if strips is not None and method != 'euler':
+        raise ValueError("The domain decomposition is only available for the 'euler' method")
+
+    from storage import save_checkpoint, load_checkpoint
+    parameters = run_parameters(np.shape(s1)[0], dt, beta, sigma, zeta, mu, deltaD, deltaE, dx, method, rtol, atol,
+                                dtype, record_every)
+    start = 0
+    if restart is not None:
+        state, metadata = load_checkpoint(restart, parameters)
+        s1, s2, s3 = state['fields']
+        start = metadata['step']
+
+    # Current and next densities, swapped after every step
+    s = np.ascontiguousarray(np.stack((s1, s2, s3)), dtype=dtype)
+    s_next = np.empty_like(s)
+    row_sums = np.empty((4, s.shape[1]))
+    if method == 'etd2':
+        E, phi1, phi2 = etd_coefficients(s.shape[1], dt, deltaD, dx, dtype)
+    elif method == 'rk23':
+        integrator = RK23Integrator(s.shape, beta, sigma, zeta, mu, deltaD, deltaE, dx, rtol=rtol, atol=atol, dtype=dtype)
+    elif strips is not None:
+        domain = StripDecomposition(s, strips, workers)
+
+    recorder = DensityRecorder(n_steps, every=record_every)
+    # Sums of the three densities after the last step, if they were computed
+    sums, sums_step = None, None
+    if restart is not None:
+        recorder.restore(state['recorder'])
+        if method == 'rk23':
+            integrator.restore(state['integrator'])
+        if start > 0 and recorder.due(start - 1):
+            sums, sums_step = np.sum(s, axis=(1, 2), dtype=np.float64), start - 1
+
+    def save(step):
+        fields = domain.gather() if strips is not None else s
+        state = dict(fields=fields, recorder=recorder.state())
+        if method == 'rk23':
+            state['integrator'] = integrator.state()
+        save_checkpoint(checkpoint, state, dict(parameters, step=step))
+
+    end = start
+    status = STOP_BUDGET
+    steps = range(start, n_steps)
+    if progress:
+        from tqdm import tqdm
+        steps = tqdm(steps, initial=start, total=n_steps)
+
+    for t in steps:
+        due = recorder.due(t)
+        if method == 'etd2' or method == 'rk23':
+            if due:
+                total = sums.sum() if sums_step == t - 1 else np.sum(s, dtype=np.float64)
+            if method == 'etd2':
+                s = etd2_step(s, s_next, E, phi1, phi2, beta, sigma, zeta, mu, deltaD, deltaE, dx)
+            else:
+                integrator.advance(s, dt)
+            if due:
+                sums, sums_step = np.sum(s, axis=(1, 2), dtype=np.float64), t
+        elif strips is not None:
+            total, *sums = domain.step(dt, beta, sigma, zeta, mu, deltaD, deltaE, dx)
+        else:
+            total, *sums = euler_kernel(s, s_next, row_sums, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx)
+            s, s_next = s_next, s
+
+        if due:
+            recorder.record((t + 1) * dt, np.divide(sums, total))
+            if extinction_threshold is not None and min(recorder.fractions[-1]) < extinction_threshold:
+                status = STOP_EXTINCTION
+            elif converge_window > 0 and recorder.size % converge_window == 0:
+                window = recorder.fractions[-converge_window:]
+                if np.all(window.max(axis=0) - window.min(axis=0) <= converge_tol):
+                    status = STOP_CONVERGED
+
+        if callback is not None and snapshot_every is not None and (t % snapshot_every == 0 or status != STOP_BUDGET):
+            if strips is not None:
+                s = domain.gather()
+            callback(t, s[0], s[1], s[2], recorder)
+
+        end = t + 1
+        if checkpoint is not None and checkpoint_every is not None and end % checkpoint_every == 0:
+            save(end)
+        if status != STOP_BUDGET:
+            break
+
+    if checkpoint is not None and (checkpoint_every is None or end % checkpoint_every != 0):
+        save(end)
+
+    if strips is not None:
+        s = domain.gather()
+        domain.close()
+
+    if method == 'rk23' and stats is not None:
+        stats.update(accepted=integrator.accepted, rejected=integrator.rejected, evaluations=integrator.evaluations)
+
+    return s[0], s[1], s[2], recorder.fractions.T, status
+
+def compare_precision(L=128, n_steps=1000, dt=0.05, beta=1.0, sigma=1.0, zeta=0.0, mu=0.0, deltaD=1.0, deltaE=1.0, dx=1.0,
+                      method='euler', checkpoints=10, seed=0):
+    """
+    Divergence between float32 and float64 runs of the same reference trajectory
+
+    Both runs start from the same initial densities (drawn with seed) and
+    are compared at checkpoints evenly spaced steps.
+
+    Returns:
+    - Dictionary with the times of the checkpoints, the maximum absolute
+      difference of the fields and their relative L2 difference at each
+      checkpoint, and the maximum difference of the species fractions
+    """
+    np.random.seed(seed)
+    s0 = initial_densities(L, beta, sigma)
+    every = max(n_steps // checkpoints, 1)
+
+    runs = {}
+    for dtype in (np.float64, np.float32):
+        snapshots = []
+        def keep(t, s1, s2, s3, recorder):
+            snapshots.append(np.array((s1, s2, s3), dtype=np.float64))
+        *_, densities, _ = run_pde(*s0, n_steps, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx,
+                                snapshot_every=every, callback=keep, method=method, dtype=dtype)
+        runs[dtype] = (np.array(snapshots), densities)
+
+    (s64, d64), (s32, d32) = runs[np.float64], runs[np.float32]
+    difference = np.abs(s32 - s64)
+    return dict(time=(np.arange(len(s64)) * every + 1) * dt,
+                max_abs=difference.max(axis=(1, 2, 3)),
+                rel_l2=np.sqrt(np.sum(difference**2, axis=(1, 2, 3)) / np.sum(s64**2, axis=(1, 2, 3))),
+                fractions_max_abs=np.abs(d32 - d64).max())
+
+def initial_ensemble(E, L=128, beta=1.0, sigma=1.0, dtype=np.float64):
+    """
+    Independent initial densities of E realisations, beta and sigma being
+    scalars or arrays with the parameters of each member
+
+    Returns:
+    - Array of shape (E, 3, L, L)
+    """
+    beta = np.broadcast_to(beta, (E,))
+    sigma = np.broadcast_to(sigma, (E,))
+    s = np.empty((E, 3, L, L), dtype=dtype)
+    for e in range(E):
+        s[e] = initial_densities(L, beta[e], sigma[e], dtype)
+    return s
+
+def run_ensemble(s, n_steps, dt, beta=1.0, sigma=1.0, zeta=0.0, mu=0.0, deltaD=1.0, deltaE=1.0, dx=1.0,
+                 snapshot_every=None, callback=None, progress=False, record_every=1):
+    """
+    Integrate E realisations together for n_steps Euler steps of size dt, the
+    fractions of each member being recorded every record_every steps
+
+    Parameters:
+    - s: Initial densities, of shape (E, 3, L, L)
+    - beta, sigma, zeta, mu: Scalars or arrays of length E with the parameters of each member
+    - snapshot_every: Steps between calls of callback (steps with t % snapshot_every == 0)
+    - callback: Called as callback(t, s, densities) after step t, s being the densities
+      of all members and densities the fractions recorded so far, of shape (E, 3, records)
+    - progress: Whether to show a progress bar
+
+    Returns:
+    - Final densities, of shape (E, 3, L, L)
+    - densities: Array of shape (E, 3, n_steps//record_every), fraction of each species
+      after every record_every steps
+    """
+    if s.ndim != 4 or s.shape[1] != 3:
+        raise ValueError(f"The ensemble must have shape (E, 3, L, L), got {s.shape}")
+    if record_every < 1:
+        raise ValueError("record_every must be a positive number of steps")
+    E = s.shape[0]
+    beta, sigma, zeta, mu = (np.ascontiguousarray(np.broadcast_to(np.asarray(p, dtype=np.float64), (E,)))
+                             for p in (beta, sigma, zeta, mu))
+
+    # Current and next densities, swapped after every step (the initial densities are left untouched)
+    s = np.array(s, order='C')
+    s_next = np.empty_like(s)
+    row_sums = np.empty((E, 4, s.shape[2]))
+    totals = np.empty((E, 4))
+    densities = np.empty((E, 3, n_steps // record_every))
+    records = 0
+
+    steps = range(n_steps)
+    if progress:
+        from tqdm import tqdm
+        steps = tqdm(steps)
+
+    for t in steps:
+        ensemble_euler_kernel(s, s_next, row_sums, totals, dt, beta, sigma, zeta, mu, deltaD, deltaE, dx)
+        s, s_next = s_next, s
+        if (t + 1) % record_every == 0:
+            densities[:, :, records] = totals[:, 1:] / totals[:, :1]
+            records += 1
+
+        if callback is not None and snapshot_every is not None and t % snapshot_every == 0:
+            callback(t, s, densities[:, :, :records])
+
+    return s, densities
@@ -0,0 +1,209 @@
+"""
+    Figures of the rock-paper-scissors simulations. Only imported when
+    something is drawn, so the simulations do not pay for matplotlib,
+    seaborn and ternary.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import colors
+import seaborn as sns
+import ternary
+import math
+
+# Colours of species 1, 2, 3 in the PDE images: Cyan, Magenta, Yellow
+PDE_COLORS = [(0, 1, 1), (1, 0, 1), (1, 1, 0)]
+
+def lattice_colormap(palette='inferno'):
+    """
+    Discrete colormap for empty sites and species A, B, C
+    """
+    cmap = colors.ListedColormap([sns.color_palette(palette, 12)[0],
+                                  sns.color_palette(palette, 12)[3],
+                                  sns.color_palette(palette, 12)[7],
+                                  sns.color_palette(palette, 12)[11]])
+    bounds = [-0.5, 0.5, 1.5, 2.5, 3.5]
+    norm = colors.BoundaryNorm(bounds, cmap.N)
+    return cmap, norm
+
+def pde_ternary_image(fields):
+    """
+    RGB image of the three densities, each site coloured by its composition
+    """
+    total = np.sum(fields, axis=0)
+    ternary_image = np.stack([s / total for s in fields], axis=-1)
+    return ternary_image @ np.array(PDE_COLORS)
+
+def render_lattice(frame, t, path, palette='inferno', dpi=100):
+    """
+    Save the image of a lattice snapshot
+    """
+    cmap, norm = lattice_colormap(palette)
+    fig, ax = plt.subplots(figsize=(5, 5))
+    img = ax.imshow(frame, cmap=cmap, norm=norm, interpolation='nearest')
+    cbar = plt.colorbar(img, ticks=[0, 1, 2, 3], shrink=0.85, ax=ax)
+    cbar.set_ticklabels([r'$\varnothing$', 'A', 'B', 'C'])
+    ax.set_title(f'Lattice State at t = {t:.2f}')
+    ax.axis('off')
+    fig.patch.set_facecolor('#cfcfcf')
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+def render_pde(fields, t, path, dpi=90):
+    """
+    Save the ternary image of a snapshot of the PDE densities
+    """
+    fig, ax = plt.subplots(figsize=(5, 5))
+    ax.imshow(pde_ternary_image(fields), interpolation='nearest')
+    ax.set_title(f"Species Densities at t={t:.1f}", fontsize=14)
+    ax.axis('off')
+    fig.patch.set_facecolor('#cfcfcf')
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+def color_point(x, y, z, scale):
+    w = 255
+    x_color = x * w / float(scale)
+    y_color = y * w / float(scale)
+    z_color = z * w / float(scale)
+    r = math.fabs(w - y_color) / w
+    g = math.fabs(w - x_color) / w
+    b = math.fabs(w - z_color) / w
+    return (r, g, b, 1.)
+
+
+def generate_heatmap_data(scale=5):
+    from ternary.helpers import simplex_iterator
+    d = dict()
+    for (i, j, k) in simplex_iterator(scale):
+        d[(i, j, k)] = color_point(i, j, k, scale)
+    return d
+
+def draw_lattice_frame(fig, ax, space, t, recorder, frame, sigma, epsilon, D, mu, palette='inferno'):
+    """
+    Draw the 2x2 figure of the lattice simulation: lattice, populations,
+    reactions and ternary trajectory (ax is the flattened array of axes)
+    """
+    size = space.shape[0]
+    y = recorder.fractions
+    cmap, norm = lattice_colormap(palette)
+    bounds = [-0.5, 0.5, 1.5, 2.5, 3.5]
+
+    ax[1].clear()
+    ax[0].clear()
+    ax[2].clear()
+    ax[3].clear()
+
+    img = ax[0].imshow(space, cmap=cmap, norm=norm)
+    ax[0].set_title(f'Lattice State at t = {t:.2f}')
+    ax[0].axis('off')
+    if frame == 0:
+        cbar = plt.colorbar(img, cmap=cmap, norm=norm, boundaries=bounds, ticks=[0, 1, 2, 3], shrink = 0.85, ax = ax[0])
+        cbar.set_ticklabels([r'$\varnothing$', 'A', 'B', 'C'])
+
+    ax[1].plot(recorder.t, y[:,0], label = 'Type A', color = sns.color_palette(palette, 12)[3], lw = 2)
+    ax[1].plot(recorder.t, y[:,1], label = 'Type B', color = sns.color_palette(palette, 12)[7], lw = 2)
+    ax[1].plot(recorder.t, y[:,2], label = 'Type C', color = sns.color_palette(palette, 12)[11], lw = 2)
+    ax[1].set_ylim(0, 1)
+    ax[1].legend(loc = 'upper center', ncol = 3)
+    ax[1].set_title('Populations Evolution')
+    ax[1].set_xlabel('Time')
+    ax[1].set_ylabel('Fraction of total')
+    ax[1].set_xlim(0, 30)
+    ax[1].patch.set_facecolor("gray")
+
+    _, tax = ternary.figure(ax = ax[3])
+
+    tax.plot(y, color='black', lw = 1)
+    tax.boundary(linewidth=1.0)
+    tax.gridlines(color="grey", multiple=0.1, alpha = 0.3)
+
+    tax.left_axis_label("C", fontsize=12, offset = 0.12)
+    tax.right_axis_label("B", fontsize=12, offset = 0.12)
+    tax.bottom_axis_label("A", fontsize=12, offset = 0.12)
+
+    tax.ticks(axis='lbr', multiple=0.2, linewidth=1, tick_formats="%.1f", offset=0.02,
+            fontsize = 9)
+    # tax.lim(0, 1)
+    tax.get_axes().axis('off')
+
+
+    ax[2].set_ylim(0, 1)
+    ax[2].set_xlim(0, 1)
+    ax[2].text(0.5, 0.9, r'Lattice size $L$ = ' + f'{size}',
+            ha = 'center', fontsize = 12)
+    ax[2].text(0.5, 0.8, 'Reactions',
+            ha = 'center', fontsize = 12, weight = 'bold')
+    ax[2].text(0.5, 0.7, r'$A + B \underset{\sigma}{\rightarrow} \varnothing + A$',
+            ha = 'center', fontsize = 11)
+    ax[2].text(0.5, 0.6, r'$B + C \underset{\sigma}{\rightarrow} \varnothing + B$',
+            ha = 'center', fontsize = 11)
+    ax[2].text(0.5, 0.5, r'$C + A \underset{\sigma}{\rightarrow} \varnothing + C$',
+            ha = 'center', fontsize = 11)
+    ax[2].text(0.5, 0.4, r'$X + Y \underset{\epsilon}{\rightarrow} Y + X$',
+            ha = 'center', fontsize = 11)
+    ax[2].text(0.5, 0.3, r'$X + \varnothing \underset{D}{\rightarrow} \varnothing + X$',
+            ha = 'center', fontsize = 11)
+    ax[2].text(0.5, 0.2, r'$X + \varnothing \underset{\mu}{\rightarrow} X + X$',
+            ha = 'center', fontsize = 11)
+    ax[2].text(0.5, 0.01, r'$\sigma = $' + f'{sigma:.1f}, ' + r'$\epsilon = $' + f'{epsilon:.1f}, ' + r'$D = $' + f'{D}, ' + f'$\mu = $' + f'{mu:.1f}',
+            ha = 'center', fontsize = 11)
+    ax[2].axis('off')
+    ax[2].patch.set_facecolor('#cfcfcf')
+
+    fig.patch.set_facecolor('#cfcfcf')
+
+def draw_pde_frame(fig, ax, fields, t, times, densities, frame, final_time, heatmap, scale=100):
+    """
+    Draw the 2x2 figure of the PDE simulation: densities, colour key,
+    equations and total densities (ax is the flattened array of axes,
+    heatmap the colour key returned by generate_heatmap_data(scale))
+    """
+    ax[0].clear()
+    ax[3].clear()
+
+    # Plot
+    ax[0].imshow(pde_ternary_image(fields), interpolation='nearest')
+    ax[0].set_title(f"Species Densities at t={t:.1f}", fontsize = 14)
+    ax[0].axis('off')
+
+    ax[3].plot(times, densities[0], color = 'cyan', lw = 2, label = 'Type 1')
+    ax[3].plot(times, densities[1], color = 'magenta', lw = 2, label = 'Type 2')
+    ax[3].plot(times, densities[2], color = 'yellow', lw = 2, label = 'Type 3')
+    ax[3].set_ylim(0, 1)
+    ax[3].set_xlim(0, final_time)
+    ax[3].set_title("Total densities", fontsize = 14)
+    ax[3].set_xlabel("Time", fontsize = 12)
+    ax[3].set_ylabel("Fraction of total", fontsize = 12)
+    ax[3].legend(loc = 'upper center', ncol = 3)
+    ax[3].patch.set_facecolor("gray")
+
+    if frame == 0:
+        figure, tax = ternary.figure(scale=scale, ax = ax[1])
+        tax.heatmap(heatmap, style="hexagonal", use_rgba=True, colorbar = False)
+        tax.ticks(axis='lbr', multiple=20, linewidth=1, tick_formats="%.0f", offset=0.02,
+                fontsize = 9)
+        tax.left_axis_label(r"Type 3 [\%]", fontsize=12, offset = 0.12)
+        tax.right_axis_label(r"Type 1 [\%]", fontsize=12, offset = 0.12)
+        tax.bottom_axis_label(r"Type 2 [\%]", fontsize=12, offset = 0.12)
+        tax.boundary()
+        tax.get_axes().axis('off')
+
+        ax[2].set_ylim(0, 1)
+        ax[2].set_xlim(0, 1)
+        ax[2].axis('off')
+        ax[2].text(0.05, 0.95, r'$\displaystyle \partial_t s_i = s_i [ \underbrace{\beta \left( 1 - r \right)}_{\mathrm{reproduction}} - \underbrace{\sigma s_{i-1}}_{\mathrm{dominance-removal}} ]$',
+                ha = 'left', fontsize = 14)
+        ax[2].text(0.05, 0.8, r'$+ \underbrace{\xi s_i \left( s_{i+1} − s_{i−1} \right)}_{\mathrm{dominance-replacement}}$', ha = 'left', fontsize = 14)
+        ax[2].text(0.05, 0.65, r'$+ \underbrace{\mu \left( s_{i−1} + s_{i+1} − 2 s_i \right)}_{\mathrm{mutation}}$',
+                ha = 'left', fontsize = 14)
+        ax[2].text(0.05, 0.5, r'$+ \underbrace{\left(\delta_E − \delta_D \right) \left[r \nabla^2 s_i − s_i \nabla^2 r \right]}_{\mathrm{non-linear-mobility}}$',
+                ha = 'left', fontsize = 14)
+        ax[2].text(0.05, 0.35, r'$+ \underbrace{\delta_D \nabla^2 s_i}_{\mathrm{diffusion}}$',
+                ha = 'left', fontsize = 12)
+        ax[2].text(0.05, 0.2, r'$r = s_1 + s_2 + s_3$',
+                ha = 'left', fontsize = 12)
+
+        ax[2].patch.set_facecolor('#cfcfcf')
+
+    fig.patch.set_facecolor('#cfcfcf')
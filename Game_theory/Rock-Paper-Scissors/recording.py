@@ -0,0 +1,158 @@
+import numpy as np
+
+class TrajectoryRecorder:
+    """
+    Preallocated record of time, Monte Carlo steps and population counts.
+    The buffers double their capacity when full, so recording N points
+    costs O(N) instead of the O(N^2) of appending to arrays.
+
+    Recording cadence:
+    - every: Record every k-th event (every = 1 records all of them)
+    - every_mcs: If positive, record whenever the Monte Carlo time advanced
+      by this amount since the last record (overrides every)
+    """
+    def __init__(self, n_species=3, capacity=1024, every=1, every_mcs=0.0):
+        if every < 1:
+            raise ValueError("every must be a positive number of events")
+        self.every = int(every)
+        self.every_mcs = float(every_mcs)
+        self.next_mcs = 0.0
+        self.size = 0
+        self._t = np.zeros(capacity)
+        self._mcs = np.zeros(capacity)
+        self._populations = np.zeros((n_species, capacity))
+
+    def reserve(self, n):
+        """
+        Make sure n more records fit in the buffers, doubling their capacity if needed
+        """
+        capacity = self._t.shape[0]
+        if self.size + n <= capacity:
+            return
+        while self.size + n > capacity:
+            capacity *= 2
+        self._t = np.resize(self._t, capacity)
+        self._mcs = np.resize(self._mcs, capacity)
+        populations = np.zeros((self._populations.shape[0], capacity))
+        populations[:, :self.size] = self._populations[:, :self.size]
+        self._populations = populations
+
+    def due(self, event, mcs):
+        """
+        Whether the state after the given event number should be recorded
+        """
+        if self.every_mcs > 0:
+            return mcs >= self.next_mcs
+        return event % self.every == 0
+
+    def record(self, t, mcs, populations):
+        self.reserve(1)
+        self._t[self.size] = t
+        self._mcs[self.size] = mcs
+        self._populations[:, self.size] = populations
+        self.size += 1
+        if self.every_mcs > 0:
+            while self.next_mcs <= mcs:
+                self.next_mcs += self.every_mcs
+
+    @property
+    def capacity(self):
+        return self._t.shape[0]
+
+    def buffers(self):
+        """
+        Full-capacity buffers of times, Monte Carlo steps and populations, for
+        compiled loops that record into them and then update size and next_mcs
+        """
+        return self._t, self._mcs, self._populations
+
+    def state(self):
+        """
+        Records and recording cadence, to be saved in a checkpoint
+        """
+        return dict(t=self.t, mcs=self.mcs, populations=self.populations, next_mcs=self.next_mcs)
+
+    def restore(self, state):
+        """
+        Replace the records by those of a checkpoint
+        """
+        n = len(state['t'])
+        self.size = 0
+        self.reserve(n)
+        self._t[:n] = state['t']
+        self._mcs[:n] = state['mcs']
+        self._populations[:, :n] = state['populations']
+        self.size = n
+        self.next_mcs = state['next_mcs']
+
+    @property
+    def t(self):
+        return self._t[:self.size]
+
+    @property
+    def mcs(self):
+        return self._mcs[:self.size]
+
+    @property
+    def populations(self):
+        return self._populations[:, :self.size]
+
+    @property
+    def fractions(self):
+        """
+        Fraction of each species among the living individuals, shape (records, species)
+        """
+        populations = self.populations
+        return (populations / np.sum(populations, axis=0)).T
+
+class DensityRecorder:
+    """
+    Preallocated record of the species fractions of the PDE, one record
+    every `every` steps (after steps every-1, 2*every-1, ...), so a run of
+    n_steps steps fills exactly n_steps//every rows.
+    """
+    def __init__(self, n_steps, n_species=3, every=1):
+        if every < 1:
+            raise ValueError("every must be a positive number of steps")
+        self.every = int(every)
+        self.size = 0
+        capacity = n_steps // self.every
+        self._t = np.empty(capacity)
+        self._fractions = np.empty((capacity, n_species))
+
+    def due(self, step):
+        """
+        Whether the state after the given step (counted from 0) should be recorded
+        """
+        return (step + 1) % self.every == 0
+
+    def record(self, t, fractions):
+        self._t[self.size] = t
+        self._fractions[self.size] = fractions
+        self.size += 1
+
+    @property
+    def t(self):
+        return self._t[:self.size]
+
+    @property
+    def fractions(self):
+        """
+        Fraction of each species, shape (records, species)
+        """
+        return self._fractions[:self.size]
+
+    def state(self):
+        """
+        Records, to be saved in a checkpoint
+        """
+        return dict(t=self.t, fractions=self.fractions)
+
+    def restore(self, state):
+        """
+        Replace the records by those of a checkpoint
+        """
+        n = len(state['t'])
+        self._t[:n] = state['t']
+        self._fractions[:n] = state['fractions']
+        self.size = n
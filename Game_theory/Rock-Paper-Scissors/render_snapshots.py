@@ -0,0 +1,64 @@
+"""
+    Offline rendering of the snapshots saved with plot = 'raw' by
+    Gillespe_lattice_Nature.py or PDE_PhysRevE.py. The chunks of the archive
+    are rendered in parallel by a pool of processes, one PNG per frame.
+
+    Example:
+        python render_snapshots.py Snapshots_Gillespe.npz Frames_Gillespe --workers 8
+"""
+
+import numpy as np
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import snapshot_chunks
+
+def render_chunk(path, chunk, first_frame, output, palette='inferno'):
+    """
+    Render every frame of one chunk, the lattice (2D frames) or PDE (3D frames) style is chosen from the frame shape
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import plots
+
+    with np.load(path) as data:
+        frames = data[chunk]
+        times = data['times_' + chunk[len('chunk_'):]]
+    for k, (t, frame) in enumerate(zip(times, frames)):
+        file = os.path.join(output, f'frame_{first_frame + k}.png')
+        if frame.ndim == 2:
+            plots.render_lattice(frame, t, file, palette=palette)
+        else:
+            plots.render_pde(frame, t, file)
+    return len(frames)
+
+def render_snapshots(path, output, workers=None, palette='inferno'):
+    """
+    Render all snapshots of an archive into output/frame_<n>.png
+
+    Returns:
+    - Number of frames rendered
+    """
+    os.makedirs(output, exist_ok=True)
+    chunks = snapshot_chunks(path)
+    # Frame numbering continues across chunks, only the small time arrays are read here
+    with np.load(path) as data:
+        lengths = [len(data['times_' + c[len('chunk_'):]]) for c in chunks]
+    first_frames = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(int)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_chunk, path, c, int(f), output, palette)
+                   for c, f in zip(chunks, first_frames)]
+        return sum(f.result() for f in futures)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Render snapshots")
+    parser.add_argument("snapshots", help="Archive written with plot = 'raw' (e.g. Snapshots_Gillespe.npz).", type=str)
+    parser.add_argument("output", help="Folder for the PNG frames.", type=str)
+    parser.add_argument("--workers", help="Number of processes (default=number of cores).", type=int, default=None)
+    parser.add_argument("--palette", help="Palette of the lattice images (default='inferno').", type=str, default='inferno')
+    args = parser.parse_args()
+
+    n = render_snapshots(args.snapshots, args.output, workers=args.workers, palette=args.palette)
+    print(f"{n} frames saved in {args.output}")
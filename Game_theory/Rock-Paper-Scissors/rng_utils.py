@@ -0,0 +1,84 @@
+"""
+    Independent random streams for the compiled engines.
+
+    Each stream is a single uint64 word of xorshift64* state, seeded with
+    splitmix64 from a master seed and the index of the stream. A parallel
+    loop gives every work item its own stream, so the numbers it draws do
+    not depend on the number of threads or on how the work is scheduled.
+
+    Reference:
+    - Vigna, S. (2016). An experimental exploration of Marsaglia's xorshift generators, scrambled. ACM Transactions on Mathematical Software, 42(4), 1-23.
+"""
+
+import numpy as np
+from numba import njit
+
+@njit
+def seed_numba(seed):
+    """
+    Seed the global generator used by np.random inside compiled functions
+    """
+    np.random.seed(seed)
+
+def get_numba_state():
+    """
+    State of the global generator of compiled functions (Mersenne Twister)
+
+    Returns:
+    - index: Position in the key
+    - key: Array of 624 uint32 words
+    """
+    # numba does not expose its generator publicly, its helper library does
+    from numba import _helperlib
+    index, key = _helperlib.rnd_get_state(_helperlib.rnd_get_np_state_ptr())
+    return index, np.array(key, dtype=np.uint32)
+
+def set_numba_state(index, key):
+    """
+    Restore a state returned by get_numba_state
+    """
+    from numba import _helperlib
+    _helperlib.rnd_set_state(_helperlib.rnd_get_np_state_ptr(), (int(index), [int(k) for k in key]))
+
+@njit
+def splitmix64(x):
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+@njit
+def seed_streams(seed, n):
+    """
+    Independent states for n streams derived from a master seed
+    """
+    states = np.empty(n, dtype=np.uint64)
+    x = splitmix64(np.uint64(seed))
+    for k in range(n):
+        x = splitmix64(x)
+        # xorshift has a fixed point at zero
+        states[k] = x if x != 0 else np.uint64(1)
+    return states
+
+@njit
+def next_uint64(states, k):
+    x = states[k]
+    x ^= x >> np.uint64(12)
+    x ^= x << np.uint64(25)
+    x ^= x >> np.uint64(27)
+    states[k] = x
+    return x * np.uint64(0x2545F4914F6CDD1D)
+
+@njit
+def next_double(states, k):
+    """
+    Uniform number in [0, 1) from stream k
+    """
+    return (next_uint64(states, k) >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+@njit
+def next_int(states, k, n):
+    """
+    Uniform integer in [0, n) from stream k
+    """
+    return int(next_double(states, k) * n)
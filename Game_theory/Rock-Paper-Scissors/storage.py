@@ -0,0 +1,402 @@
+"""
+    On-disk storage of simulation snapshots and results.
+
+    Everything is written to zip archives readable with np.load, one .npy
+    member per array. Members are optionally compressed and written by a
+    background thread (ArchiveWriter), so the simulation keeps running while
+    the previous data is compressed.
+
+    An archive is written next to its path and renamed over it when closed
+    or synced, so a run that fails or is killed never leaves a truncated file
+    in place of the previous one. After a sync, the members are appended to
+    the archive at path, which can be read again after the next sync.
+
+    Snapshots are appended in chunks of consecutive frames: member
+    chunk_00000 holds frames 0 to chunk_size-1 stacked along the first axis,
+    times_00000 their times, and so on.
+
+    A results file (ResultsWriter) holds a metadata member with the
+    parameters of the run as JSON, any number of time series stored as
+    chunks under their own prefix (e.g. densities/chunk_00000), written
+    during the run, and final arrays such as the last lattice. Syncing it
+    at every snapshot keeps a readable file with the records so far if the
+    job is killed.
+
+    A checkpoint (save_checkpoint) holds everything needed to resume a run:
+    the state of the engine and of its recorder, one member per array
+    (e.g. lattice/space, recorder/t), and the parameters of the run as
+    JSON, checked on restart by load_checkpoint.
+"""
+
+import numpy as np
+import zipfile
+import threading
+import queue
+import json
+import os
+
+RESULTS_FORMAT_VERSION = 1
+
+class ArchiveWriter:
+    """
+    Zip archive of .npy members written by a background thread
+
+    The members go to path + '.tmp', which replaces path on close. Use it
+    as a context manager (or close it in a finally clause) so that the data
+    written before an exception or an interruption is kept. sync makes the
+    members written so far readable at path before the archive is closed.
+    An error of the writer thread is raised by the next put, sync and close.
+
+    Parameters:
+    - path: Output file (.npz)
+    - compress: Whether to deflate the members
+    - max_pending: Number of members that may wait for the writer thread before put blocks
+    """
+    def __init__(self, path, compress=True, max_pending=8):
+        self.path = path
+        self._tmp = path + '.tmp'
+        self._file = self._tmp
+        self._options = dict(compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                             compresslevel=1 if compress else None, allowZip64=True)
+        self._zip = zipfile.ZipFile(self._tmp, 'w', **self._options)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_members, daemon=True)
+        self._thread.start()
+
+    def _write_members(self):
+        # After an error the queue is still drained, so that put and close never block
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            if self._error is None:
+                name, array = item
+                try:
+                    with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+                        np.lib.format.write_array(f, array, allow_pickle=False)
+                except Exception as e:
+                    self._error = e
+            self._queue.task_done()
+
+    def put(self, name, array):
+        """
+        Queue an array to be written as member name, the array must not be modified afterwards
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((name, array))
+
+    def sync(self):
+        """
+        Write the queued members and complete the archive at path, so that it
+        can be read with np.load while the run goes on
+
+        The members put afterwards are appended to it: a job killed before
+        the next sync may leave path unreadable, so put the members of a
+        snapshot together and sync right after them.
+        """
+        self._queue.join()
+        if self._error is not None:
+            raise self._error
+        self._zip.close()
+        if self._file != self.path:
+            os.replace(self._file, self.path)
+            self._file = self.path
+        self._zip = zipfile.ZipFile(self.path, 'a', **self._options)
+
+    def close(self):
+        """
+        Write the queued members and move the archive to path, or raise the
+        error of the writer thread, in which case the temporary archive is not
+        moved over path
+        """
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._zip.close()
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+        if self._error is not None:
+            raise self._error
+        if self._file != self.path:
+            os.replace(self._file, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ChunkedArrayWriter:
+    """
+    Append frames of a fixed shape to a chunked archive
+
+    Parameters:
+    - path: Output file (.npz), or an open ArchiveWriter shared with other data
+    - frame_shape: Shape of each frame, e.g. (L, L) for the lattice or (3, L, L) for the PDE fields
+    - dtype: Data type of the frames
+    - chunk_size: Number of frames per chunk
+    - compress: Whether to deflate the chunks (ignored for a shared archive)
+    - max_pending: Number of chunks that may wait for the writer thread before append blocks
+    - prefix: Prefix of the member names, e.g. 'densities/'
+    """
+    def __init__(self, path, frame_shape, dtype, chunk_size=64, compress=True, max_pending=4, prefix=''):
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        self.frames = 0
+        self._buffer = np.empty((chunk_size,) + tuple(frame_shape), dtype=dtype)
+        self._times = np.empty(chunk_size)
+        self._filled = 0
+        self._chunks = 0
+        self._owns_archive = not isinstance(path, ArchiveWriter)
+        self._archive = ArchiveWriter(path, compress, 2*max_pending) if self._owns_archive else path
+        self.path = self._archive.path
+
+    def append(self, frame, t=np.nan):
+        """
+        Copy a frame (and its time) into the current chunk
+        """
+        self._buffer[self._filled] = frame
+        self._times[self._filled] = t
+        self._filled += 1
+        self.frames += 1
+        if self._filled == self.chunk_size:
+            self.flush()
+
+    def extend(self, frames, times):
+        """
+        Copy several frames (and their times) into the chunks
+        """
+        start = 0
+        while start < len(frames):
+            n = min(len(frames) - start, self.chunk_size - self._filled)
+            self._buffer[self._filled:self._filled + n] = frames[start:start + n]
+            self._times[self._filled:self._filled + n] = times[start:start + n]
+            self._filled += n
+            self.frames += n
+            start += n
+            if self._filled == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Hand the frames gathered so far to the writer thread
+        """
+        if self._filled == 0:
+            return
+        self._archive.put(f'{self.prefix}chunk_{self._chunks:05d}', self._buffer[:self._filled].copy())
+        self._archive.put(f'{self.prefix}times_{self._chunks:05d}', self._times[:self._filled].copy())
+        self._chunks += 1
+        self._filled = 0
+
+    def close(self):
+        self.flush()
+        if self._owns_archive:
+            self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _chunk_names(data, prefix=''):
+    return sorted(name for name in data.files
+                  if name.startswith(prefix + 'chunk_') and '/' not in name[len(prefix):])
+
+def _times_name(chunk):
+    head, _, index = chunk.rpartition('chunk_')
+    return head + 'times_' + index
+
+def iter_snapshots(path, prefix=''):
+    """
+    Iterate over the (time, frame) pairs of a chunked archive, one chunk in memory at a time
+    """
+    with np.load(path) as data:
+        for name in _chunk_names(data, prefix):
+            frames = data[name]
+            times = data[_times_name(name)]
+            for t, frame in zip(times, frames):
+                yield t, frame
+
+def load_snapshots(path, prefix=''):
+    """
+    All frames of a chunked archive (or of the series stored under prefix)
+
+    Returns:
+    - times: Time of each frame
+    - frames: Frames stacked along the first axis
+    """
+    with np.load(path) as data:
+        return _load_series(data, prefix)
+
+def _load_series(data, prefix=''):
+    chunks = _chunk_names(data, prefix)
+    if len(chunks) == 0:
+        return np.array([]), np.array([])
+    frames = np.concatenate([data[name] for name in chunks])
+    times = np.concatenate([data[_times_name(name)] for name in chunks])
+    return times, frames
+
+def snapshot_chunks(path):
+    """
+    Names of the chunks of an archive, so that they can be processed independently
+    """
+    with np.load(path) as data:
+        return _chunk_names(data)
+
+class ResultsWriter:
+    """
+    Results file of a run: metadata, time series written during the run and final arrays
+
+    The file is readable with all the records given so far after each sync,
+    and complete once closed.
+
+    Parameters:
+    - path: Output file (.npz)
+    - metadata: Dictionary with the parameters of the run (seed, dt, ...), stored as JSON
+      together with the format version
+    - compress: Whether to deflate the data
+
+    Example:
+        with ResultsWriter('Result_PDE.npz', dict(dt=0.1, seed=1)) as results:
+            densities = results.series('densities', (3,))
+            densities.append(fractions, t)
+            results.sync()
+            ...
+            results.write('lattice', fields)
+    """
+    def __init__(self, path, metadata=None, compress=True):
+        self.path = path
+        self._archive = ArchiveWriter(path, compress)
+        self._series = {}
+        metadata = dict(metadata or {}, format_version=RESULTS_FORMAT_VERSION)
+        self._archive.put('metadata', np.array(json.dumps(metadata, default=_json_default)))
+
+    def series(self, name, frame_shape=(), dtype=np.float64, chunk_size=4096):
+        """
+        Time series written to the file every chunk_size records and at every sync
+
+        Returns:
+        - ChunkedArrayWriter storing the series under name/
+        """
+        if name not in self._series:
+            self._series[name] = ChunkedArrayWriter(self._archive, frame_shape, dtype, chunk_size, prefix=name + '/')
+        return self._series[name]
+
+    def write(self, name, array):
+        """
+        Store a final array
+        """
+        self._archive.put(name, np.array(array))
+
+    def sync(self):
+        """
+        Write the records of every series and make the file readable as it is
+        """
+        for series in self._series.values():
+            series.flush()
+        self._archive.sync()
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _json_default(value):
+    # NumPy scalars and arrays in the metadata
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot store {type(value)} in the metadata")
+
+def read_results(path):
+    """
+    Content of a results file
+
+    Returns:
+    - Dictionary with the metadata under 'metadata', each time series as a
+      (times, values) pair and each final array under its name
+    """
+    results = {}
+    with np.load(path) as data:
+        series = set()
+        for name in data.files:
+            if name == 'metadata':
+                results['metadata'] = json.loads(data[name].item())
+            elif '/' in name:
+                series.add(name.rpartition('/')[0])
+            else:
+                results[name] = data[name]
+        for name in series:
+            results[name] = _load_series(data, name + '/')
+    return results
+
+def save_checkpoint(path, state, metadata=None):
+    """
+    Write the state of a run atomically: the file is written next to path
+    and then renamed, so a job killed while writing leaves the previous
+    checkpoint intact
+
+    Parameters:
+    - path: Output file (.npz)
+    - state: Dictionary of arrays and numbers, or of such dictionaries (stored as name/key)
+    - metadata: Parameters of the run, stored as JSON
+    """
+    arrays = {}
+    for name, value in state.items():
+        if isinstance(value, dict):
+            arrays.update({f'{name}/{key}': np.asarray(v) for key, v in value.items()})
+        else:
+            arrays[name] = np.asarray(value)
+    metadata = dict(metadata or {}, format_version=RESULTS_FORMAT_VERSION)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata, default=_json_default)), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_checkpoint(path, parameters=None):
+    """
+    Read a checkpoint written by save_checkpoint
+
+    Parameters:
+    - path: Checkpoint file
+    - parameters: Parameters of the resumed run, a ValueError is raised if
+      any of them differs from the one stored in the checkpoint
+
+    Returns:
+    - state: Dictionary as given to save_checkpoint, numbers as Python scalars
+    - metadata: Parameters of the run
+    """
+    state = {}
+    with np.load(path) as data:
+        metadata = json.loads(data['metadata'].item())
+        for name in data.files:
+            if name == 'metadata':
+                continue
+            value = data[name]
+            value = value.item() if value.ndim == 0 else value
+            group, _, key = name.rpartition('/')
+            if group:
+                state.setdefault(group, {})[key] = value
+            else:
+                state[key] = value
+    if parameters is not None:
+        stored = json.loads(json.dumps(parameters, default=_json_default))
+        different = [f"{name} = {stored[name]} (checkpoint: {metadata.get(name)})"
+                     for name in stored if metadata.get(name) != stored[name]]
+        if different:
+            raise ValueError(f"The run does not match the checkpoint {path}: " + ", ".join(different))
+    return state, metadata
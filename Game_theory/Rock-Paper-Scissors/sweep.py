@@ -0,0 +1,171 @@
+"""
+    Parameter sweeps of the lattice rock-paper-scissors model.
+
+    Runs the model over a grid of hopping rates D, pair-exchange rates
+    epsilon, lattice sizes and seeds in a process pool, and stores the
+    extinction time and final densities of each run in a single columnar
+    .npz file (one array per column). Grid points already present in the
+    results file are skipped, so an interrupted sweep resumes where it
+    stopped. The settings shared by all the runs (sigma, mu, max_time, ...)
+    are stored with the columns as JSON, and a sweep with other settings
+    refuses to resume into the same file.
+
+    Reference:
+    - Reichenbach, T., Mobilia, M. & Frey, E. Mobility promotes and jeopardizes biodiversity in rock–paper–scissors games. Nature 448, 1046–1049 (2007).
+"""
+
+import warnings
+warnings.filterwarnings("ignore")
+import numpy as np
+import itertools
+import argparse
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gillespie_utils import GillespieLattice, random_lattice, STOP_ABSORBING, STOP_EXTINCTION
+from montecarlo_utils import SublatticeLattice
+from recording import TrajectoryRecorder
+from rng_utils import seed_numba
+
+KEY_COLUMNS = ('D', 'epsilon', 'size', 'seed')
+COLUMN_TYPES = {
+    'D': np.float64, 'epsilon': np.float64, 'size': np.int64, 'seed': np.int64,
+    'extinction_time': np.float64, 'final_time': np.float64,
+    'density_A': np.float64, 'density_B': np.float64, 'density_C': np.float64,
+    'absorbed': np.bool_
+}
+COLUMNS = tuple(COLUMN_TYPES)
+
+def parameter_grid(D, epsilon, size, seeds):
+    """
+    All combinations of the swept parameters as a list of dictionaries
+    """
+    return [dict(D=d, epsilon=e, size=l, seed=s)
+            for d, e, l, s in itertools.product(D, epsilon, size, seeds)]
+
+def run_point(point, sigma=1.0, mu=1.0, initial_density=0.5, max_time=1000.0, mode='gillespie', tile=8):
+    """
+    Run one realisation until the first extinction, an absorbing state or max_time
+
+    The engines stop by themselves at the event (sweep) where a species
+    dies out, which gives the extinction time (NaN if no species went extinct).
+
+    Returns:
+    - Dictionary with the grid point and the results of the run
+    """
+    np.random.seed(point['seed'])
+    seed_numba(point['seed'])
+    space = random_lattice(point['size'], initial_density)
+    if mode == 'sublattice':
+        lattice = SublatticeLattice(space, sigma, mu, point['epsilon'], point['D'], tile=tile, seed=point['seed'])
+    else:
+        lattice = GillespieLattice(space, sigma, mu, point['epsilon'], point['D'])
+
+    # Only the final state matters here, keep the recorder small
+    recorder = TrajectoryRecorder(capacity=2, every=np.iinfo(np.int64).max)
+    status = lattice.run(np.iinfo(np.int64).max, recorder, max_time=max_time, stop_extinction=True)
+    extinction_time = lattice.t if status in (STOP_EXTINCTION, STOP_ABSORBING) else np.nan
+
+    densities = lattice.populations / space.size
+    return dict(point, extinction_time=extinction_time, final_time=lattice.t,
+                density_A=densities[0], density_B=densities[1], density_C=densities[2],
+                absorbed=status == STOP_ABSORBING)
+
+def run_settings(**kwargs):
+    """
+    Settings shared by all the runs of a sweep: the arguments of run_point
+    other than the grid point, defaults included
+    """
+    settings = inspect.signature(run_point).bind(None, **kwargs)
+    settings.apply_defaults()
+    return {name: value for name, value in settings.arguments.items() if name != 'point'}
+
+def load_results(path):
+    """
+    Results of a sweep as a dictionary of columns (empty if the file does not exist)
+    """
+    if not os.path.exists(path):
+        return {c: np.array([], dtype=COLUMN_TYPES[c]) for c in COLUMNS}
+    with np.load(path) as data:
+        return {c: data[c] for c in COLUMNS}
+
+def check_settings(path, settings):
+    """
+    Raise a ValueError if the results file was written with other run settings
+    """
+    if not os.path.exists(path):
+        return
+    with np.load(path) as data:
+        if 'settings' not in data.files:
+            raise ValueError(f"{path} does not record the settings of its runs, use a new results file")
+        stored = json.loads(data['settings'].item())
+    different = [f"{name} = {settings[name]} (results file: {stored.get(name)})"
+                 for name in settings if stored.get(name) != settings[name]]
+    if different:
+        raise ValueError(f"The sweep does not match the runs in {path}: " + ", ".join(different))
+
+def save_results(path, results, settings):
+    """
+    Write the columns and the run settings atomically, so an interruption never corrupts the file
+    """
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, settings=np.array(json.dumps(settings)), **results)
+    os.replace(tmp, path)
+
+def run_sweep(path, grid, workers=None, **kwargs):
+    """
+    Run every grid point not yet in the results file, appending each
+    finished run to it
+
+    Parameters:
+    - path: Results file (.npz)
+    - grid: List of grid points, as returned by parameter_grid
+    - workers: Number of processes (default: number of cores)
+    - kwargs: Remaining arguments of run_point, which must be those of the
+      runs already in the results file
+
+    Returns:
+    - Dictionary with the columns of all results
+    """
+    settings = run_settings(**kwargs)
+    check_settings(path, settings)
+    results = load_results(path)
+    done = set(zip(*(results[c].tolist() for c in KEY_COLUMNS)))
+    pending = [p for p in grid if tuple(p[c] for c in KEY_COLUMNS) not in done]
+    print(f"{len(grid) - len(pending)} of {len(grid)} grid points already done, running {len(pending)}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_point, p, **kwargs) for p in pending]
+        for n, future in enumerate(as_completed(futures)):
+            row = future.result()
+            for c in COLUMNS:
+                results[c] = np.append(results[c], np.array([row[c]], dtype=COLUMN_TYPES[c]))
+            save_results(path, results, settings)
+            print(f"[{n+1}/{len(pending)}] D = {row['D']}, epsilon = {row['epsilon']}, L = {row['size']}, seed = {row['seed']}: "
+                  f"extinction time = {row['extinction_time']:.2f}")
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Parameter sweep of the lattice rock-paper-scissors model")
+    parser.add_argument("results", help="Results file (.npz). Grid points already in it are skipped, the other arguments must then be those of the runs it holds.", type=str)
+    parser.add_argument("--D", help="Hopping rates to sweep.", type=float, nargs='+', required=True)
+    parser.add_argument("--epsilon", help="Pair-exchange rates to sweep.", type=float, nargs='+', required=True)
+    parser.add_argument("--size", help="Lattice sizes to sweep.", type=int, nargs='+', required=True)
+    parser.add_argument("--seeds", help="Number of realisations (seeds 0, 1, ...) of each parameter set (default=10).", type=int, default=10)
+    parser.add_argument("--sigma", help="Dominance-removal rate (default=1).", type=float, default=1.0)
+    parser.add_argument("--mu", help="Reproduction rate (default=1).", type=float, default=1.0)
+    parser.add_argument("--max_time", help="Maximum simulated time of each run (default=1000).", type=float, default=1000.0)
+    parser.add_argument("--mode", help="'gillespie' (default) or 'sublattice' Monte Carlo sweeps.", type=str, default='gillespie', choices=['gillespie', 'sublattice'])
+    parser.add_argument("--tile", help="(Sublattice mode) Side of the tiles updated in parallel (default=8).", type=int, default=8)
+    parser.add_argument("--workers", help="Number of processes (default=number of cores).", type=int, default=None)
+    args = parser.parse_args()
+
+    grid = parameter_grid(args.D, args.epsilon, args.size, range(args.seeds))
+    try:
+        run_sweep(args.results, grid, workers=args.workers, sigma=args.sigma, mu=args.mu,
+                  max_time=args.max_time, mode=args.mode, tile=args.tile)
+    except ValueError as e:
+        parser.error(str(e))